@@ -3,9 +3,24 @@ Admin UI handling for the fraud detection service.
 Provides a web UI to view stored requests.
 """
 from aiohttp import web
+import asyncio
 import datetime
+import gzip
 import html
-from storage import load_requests
+import zlib
+from collections import OrderedDict
+from urllib.parse import urlencode
+from typing import Dict, Any, List, Optional, Tuple
+from storage import query_requests, last_entry_id
+from template_index import template_index
+from config import (
+    ADMIN_PAGE_SIZE, ADMIN_MAX_PAGE_SIZE, ADMIN_PAGE_CACHE_SIZE, ADMIN_COMPRESS_MIN_BYTES, TEMPLATE_ADMIN_TOP,
+)
+
+try:
+    import brotli  # Optional: preferred over gzip when installed
+except ImportError:
+    brotli = None
 
 # HTML template for the admin page
 ADMIN_HTML_TEMPLATE = """
@@ -83,6 +98,27 @@ ADMIN_HTML_TEMPLATE = """
         .refresh:hover {{
             background-color: #0069d9;
         }}
+        .filters {{
+            margin: 10px 0 20px 0;
+            font-size: 16px;
+        }}
+        .filters input, .filters select {{
+            font-size: 16px;
+            padding: 4px;
+            margin-right: 10px;
+        }}
+        .pagination {{
+            margin: 10px 0;
+        }}
+        .pagination a {{
+            margin-right: 20px;
+        }}
+        .templates {{
+            margin: 10px 0;
+        }}
+        .templates table {{
+            margin-top: 10px;
+        }}
         .no-data {{
             background-color: #f8f9fa;
             padding: 20px;
@@ -96,26 +132,50 @@ ADMIN_HTML_TEMPLATE = """
 <body>
     <h1>Customer Requests</h1>
     <button class="refresh" onclick="window.location.reload()">Refresh Data</button>
+    <a href="/admin/summary">Summary (JSON)</a>
     <div style="margin: 10px 0;">
         <span class="safe" style="padding: 5px 10px; border-radius: 4px;">Safe (0.00-0.33)</span>
         <span class="warning" style="padding: 5px 10px; border-radius: 4px; margin: 0 10px;">Warning (0.33-0.66)</span>
         <span class="danger" style="padding: 5px 10px; border-radius: 4px;">Fraud (0.66-1.00)</span>
     </div>
     
+    {templates}
+    {filter_form}
+    {pagination}
     {table_content}
+    {pagination}
     
     <script>
-        // Auto-refresh the page every 30 seconds
-        setTimeout(function() {{
-            window.location.reload();
-        }}, 30000);
+        // Live updates: new rows are pushed over Server-Sent Events and added to the top.
+        // Only the newest page is live; older pages stay as they are.
+        var LIVE = {live};
+        var PAGE_SIZE = {page_size};
+        if (LIVE && window.EventSource) {{
+            var source = new EventSource("/admin/events" + window.location.search);
+            source.addEventListener("row", function(event) {{
+                var tbody = document.querySelector("#requests tbody");
+                if (!tbody) {{
+                    // The "no data" placeholder is shown; load the page with a table
+                    window.location.reload();
+                    return;
+                }}
+                tbody.insertAdjacentHTML("afterbegin", JSON.parse(event.data).html);
+                while (tbody.rows.length > PAGE_SIZE) {{
+                    tbody.deleteRow(-1);
+                }}
+            }});
+            source.addEventListener("reload", function() {{
+                source.close();
+                window.location.reload();
+            }});
+        }}
     </script>
 </body>
 </html>
 """
 
 TABLE_TEMPLATE = """
-<table>
+<table id="requests">
     <thead>
         <tr>
             <th>Time</th>
@@ -143,6 +203,63 @@ ROW_TEMPLATE = """
 </tr>
 """
 
+FILTER_FORM_TEMPLATE = """
+<form class="filters" method="get" action="/admin">
+    <label>Band
+        <select name="band">
+            {band_options}
+        </select>
+    </label>
+    <label>Fraud
+        <select name="fraud">
+            {fraud_options}
+        </select>
+    </label>
+    <label>User ID <input type="text" name="user_id" value="{user_id}"></label>
+    <label>From <input type="date" name="since" value="{since}"></label>
+    <label>To <input type="date" name="until" value="{until}"></label>
+    <label>Per page <input type="number" name="page_size" min="1" max="{max_page_size}" value="{page_size}"></label>
+    <button type="submit">Filter</button>
+    <a href="/admin">Clear</a>
+</form>
+"""
+
+TEMPLATES_TEMPLATE = """
+<details class="templates">
+    <summary>Repeated message templates ({count})</summary>
+    <table>
+        <thead>
+            <tr>
+                <th>Cluster</th>
+                <th>Messages</th>
+                <th>Scored by LLM</th>
+                <th>Flagged</th>
+                <th>Avg. score</th>
+                <th>Verdict reusable</th>
+                <th>Last seen</th>
+                <th>Example</th>
+            </tr>
+        </thead>
+        <tbody>
+            {rows}
+        </tbody>
+    </table>
+</details>
+"""
+
+TEMPLATE_ROW_TEMPLATE = """
+<tr class="{row_class}">
+    <td>{id}</td>
+    <td>{size}</td>
+    <td>{verdicts}</td>
+    <td>{flagged}</td>
+    <td class="score">{score}</td>
+    <td>{decided}</td>
+    <td class="timestamp">{last_seen}</td>
+    <td class="text-content">{sample}</td>
+</tr>
+"""
+
 NO_DATA_TEMPLATE = """
 <div class="no-data">
     No requests have been recorded yet. Submit some requests to see them here.
@@ -172,47 +289,272 @@ def sanitize_text(text):
         return "N/A"
     return html.escape(text)
 
+# Score bands shown in the legend, as [min, max) ranges
+SCORE_BANDS = {
+    "safe": (0.0, 0.33),
+    "warning": (0.33, 0.66),
+    "danger": (0.66, None),
+}
+
+def render_row(req: Dict[str, Any]) -> Optional[str]:
+    """Render a single stored request as a table row, or None if it is malformed."""
+    try:
+        timestamp = format_timestamp(req["timestamp"])
+        user_id = sanitize_text(req["request"].get("user_id", "Unknown"))
+        
+        # Format location
+        lat = req["request"].get("latitude", "N/A")
+        lng = req["request"].get("longitude", "N/A")
+        location = f"{lat}, {lng}" if lat != "N/A" and lng != "N/A" else "N/A"
+        
+        # Full text instead of truncated
+        request_text = sanitize_text(req["request"]["request_text"])
+        score = req["response"]["score"]
+        comment = sanitize_text(req["response"]["comment"])
+        
+        row_class = get_row_class(score)
+        
+        return ROW_TEMPLATE.format(
+            row_class=row_class,
+            timestamp=timestamp,
+            user_id=user_id,
+            location=location,
+            request_text=request_text,
+            score=f"{score:.2f}",
+            comment=comment
+        )
+    except (KeyError, TypeError):
+        # Skip malformed entries
+        return None
+
+def parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+def parse_filters(query) -> Dict[str, Any]:
+    """Translate admin query-string parameters into storage query filters."""
+    filters: Dict[str, Any] = {}
+    band = SCORE_BANDS.get(query.get("band", ""))
+    if band:
+        min_score, max_score = band
+        filters["min_score"] = min_score
+        if max_score is not None:
+            filters["max_score"] = max_score
+    fraud = query.get("fraud", "")
+    if fraud in ("0", "1"):
+        filters["fraud"] = int(fraud)
+    if query.get("user_id"):
+        filters["user_id"] = query["user_id"]
+    if query.get("since"):
+        filters["since"] = query["since"]
+    if query.get("until"):
+        until = query["until"]
+        try:
+            # Date inputs are inclusive of the chosen day
+            day = datetime.date.fromisoformat(until)
+            until = (day + datetime.timedelta(days=1)).isoformat()
+        except ValueError:
+            pass
+        filters["until"] = until
+    return filters
+
+def fetch_page(filters: Dict[str, Any], page_size: int, before: Optional[int],
+               after: Optional[int]) -> Tuple[List[Dict[str, Any]], bool]:
+    """Fetch one page of entries newest first, plus whether more exist past the cursor."""
+    if after is not None:
+        # Walking back towards newer entries: read oldest first from the cursor, then flip
+        entries = list(query_requests(newest_first=False, limit=page_size + 1, after_id=after, **filters))
+        has_more = len(entries) > page_size
+        return entries[:page_size][::-1], has_more
+    entries = list(query_requests(newest_first=True, limit=page_size + 1, before_id=before, **filters))
+    return entries[:page_size], len(entries) > page_size
+
+class RenderedPageCache:
+    """Rendered admin pages by query string, valid while the log's high-water mark is unchanged."""
+
+    def __init__(self, max_entries: int = ADMIN_PAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.mark: Optional[int] = None
+        # query key -> {content encoding: body}
+        self.pages: "OrderedDict[str, Dict[str, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, mark: int) -> Optional[Dict[str, bytes]]:
+        if mark != self.mark:
+            # New entries were written; every cached page may be stale
+            self.pages.clear()
+            self.mark = mark
+        bodies = self.pages.get(key)
+        if bodies is None:
+            self.misses += 1
+            return None
+        self.pages.move_to_end(key)
+        self.hits += 1
+        return bodies
+
+    def put(self, key: str, mark: int, bodies: Dict[str, bytes]) -> None:
+        if mark != self.mark:
+            return
+        self.pages[key] = bodies
+        while len(self.pages) > self.max_entries:
+            self.pages.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pages": len(self.pages), "hits": self.hits, "misses": self.misses}
+
+page_cache = RenderedPageCache()
+
+# Changes whenever the page markup does, so a deploy invalidates browsers' cached copies
+PAGE_VERSION = format(zlib.crc32("".join(
+    [ADMIN_HTML_TEMPLATE, TABLE_TEMPLATE, ROW_TEMPLATE, FILTER_FORM_TEMPLATE, TEMPLATES_TEMPLATE,
+     TEMPLATE_ROW_TEMPLATE, NO_DATA_TEMPLATE, str(ADMIN_PAGE_SIZE)]).encode()), "x")
+
+def make_etag(mark: int) -> str:
+    # Weak, as the same page may be sent with different content encodings
+    return f'W/"{mark}-{PAGE_VERSION}"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: ignore the W/ prefix on either side
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def choose_encoding(accept_encoding: str) -> str:
+    """Pick br or gzip from an Accept-Encoding header, falling back to identity."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        params = params.strip().replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return "identity"
+
+def encode_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body)
+    if encoding == "gzip":
+        # mtime=0 keeps the output identical for identical pages
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    return body
+
+def render_templates() -> str:
+    """Summary of the largest near-duplicate clusters, or nothing if there are none."""
+    clusters = template_index.top_clusters(TEMPLATE_ADMIN_TOP)
+    if not clusters:
+        return ""
+    rows = []
+    for cluster in clusters:
+        score = cluster.score_sum / cluster.verdicts if cluster.verdicts else None
+        rows.append(TEMPLATE_ROW_TEMPLATE.format(
+            row_class=get_row_class(score) if score is not None else "",
+            id=cluster.id,
+            size=cluster.size,
+            verdicts=cluster.verdicts,
+            flagged=cluster.flagged,
+            score=f"{score:.2f}" if score is not None else "N/A",
+            decided="yes" if cluster.decided else "no",
+            last_seen=format_timestamp(cluster.last_seen),
+            sample=sanitize_text(cluster.sample),
+        ))
+    return TEMPLATES_TEMPLATE.format(count=len(clusters), rows="".join(rows))
+
+def render_options(options: List[Tuple[str, str]], selected: str) -> str:
+    return "".join(
+        f'<option value="{value}"{" selected" if value == selected else ""}>{label}</option>'
+        for value, label in options
+    )
+
 async def handle_admin(request):
-    """Handler for the admin UI page."""
-    requests = await load_requests()
+    """Handler for the admin UI page.
+
+    Answers 304 when the log has not changed since the client's copy (ETag), serves
+    rendered pages from page_cache until new entries arrive, and compresses the HTML.
+    """
+    # Every append moves the high-water mark, so it versions every page
+    mark = await asyncio.to_thread(last_entry_id)
+    etag = make_etag(mark)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("If-None-Match", ""), etag):
+        return web.Response(status=304, headers=headers)
+
+    key = urlencode(sorted(request.query.items()))
+    bodies = page_cache.get(key, mark)
+    if bodies is None:
+        bodies = {"identity": (await render_admin_page(request.query)).encode()}
+        page_cache.put(key, mark, bodies)
+
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if len(bodies["identity"]) < ADMIN_COMPRESS_MIN_BYTES:
+        encoding = "identity"
+    if encoding not in bodies:
+        # Compressed once per cached page, not per request
+        bodies[encoding] = await asyncio.to_thread(encode_body, bodies["identity"], encoding)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return web.Response(body=bodies[encoding], content_type='text/html', charset='utf-8', headers=headers)
+
+async def render_admin_page(query) -> str:
+    """Render one cursor-paginated page of the admin UI."""
+    filters = parse_filters(query)
+    page_size = parse_int(query.get("page_size")) or ADMIN_PAGE_SIZE
+    page_size = max(1, min(page_size, ADMIN_MAX_PAGE_SIZE))
+    before = parse_int(query.get("before"))
+    after = parse_int(query.get("after"))
+
+    # Storage reads are blocking file/database I/O
+    entries, has_more = await asyncio.to_thread(fetch_page, filters, page_size, before, after)
+
+    rows = [row for row in map(render_row, entries) if row is not None]
     
-    if not requests:
+    if not rows:
         table_content = NO_DATA_TEMPLATE
     else:
-        rows = []
-        # Reverse to show newest first
-        for req in reversed(requests):
-            try:
-                timestamp = format_timestamp(req["timestamp"])
-                user_id = req["request"].get("user_id", "Unknown")
-                
-                # Format location
-                lat = req["request"].get("latitude", "N/A")
-                lng = req["request"].get("longitude", "N/A")
-                location = f"{lat}, {lng}" if lat != "N/A" and lng != "N/A" else "N/A"
-                
-                # Full text instead of truncated
-                request_text = sanitize_text(req["request"]["request_text"])
-                score = req["response"]["score"]
-                comment = sanitize_text(req["response"]["comment"])
-                
-                row_class = get_row_class(score)
-                
-                row = ROW_TEMPLATE.format(
-                    row_class=row_class,
-                    timestamp=timestamp,
-                    user_id=user_id,
-                    location=location,
-                    request_text=request_text,
-                    score=f"{score:.2f}",
-                    comment=comment
-                )
-                rows.append(row)
-            except (KeyError, TypeError) as e:
-                # Skip malformed entries
-                continue
-        
         table_content = TABLE_TEMPLATE.format(rows="".join(rows))
+
+    # Keep the current filters on the pagination links
+    link_params = {key: query[key] for key in ("band", "fraud", "user_id", "since", "until") if query.get(key)}
+    if page_size != ADMIN_PAGE_SIZE:
+        link_params["page_size"] = page_size
+    links = []
+    if entries:
+        newer_exists = (after is not None and has_more) or before is not None
+        older_exists = has_more if after is None else True
+        if newer_exists:
+            links.append(f'<a href="/admin?{urlencode(link_params)}">&laquo; Newest</a>')
+            links.append(f'<a href="/admin?{urlencode({**link_params, "after": entries[0]["id"]})}">&lsaquo; Newer</a>')
+        if older_exists:
+            links.append(f'<a href="/admin?{urlencode({**link_params, "before": entries[-1]["id"]})}">Older &rsaquo;</a>')
+    pagination = f'<div class="pagination">{"".join(links)}</div>' if links else ""
+
+    filter_form = FILTER_FORM_TEMPLATE.format(
+        band_options=render_options(
+            [("", "All"), ("safe", "Safe"), ("warning", "Warning"), ("danger", "Fraud")], query.get("band", "")),
+        fraud_options=render_options([("", "All"), ("1", "Fraud"), ("0", "Not fraud")], query.get("fraud", "")),
+        user_id=html.escape(query.get("user_id", "")),
+        since=html.escape(query.get("since", "")),
+        until=html.escape(query.get("until", "")),
+        page_size=page_size,
+        max_page_size=ADMIN_MAX_PAGE_SIZE,
+    )
     
-    html_content = ADMIN_HTML_TEMPLATE.format(table_content=table_content)
-    return web.Response(text=html_content, content_type='text/html')
\ No newline at end of file
+    html_content = ADMIN_HTML_TEMPLATE.format(
+        templates=render_templates(),
+        filter_form=filter_form,
+        pagination=pagination,
+        table_content=table_content,
+        live="true" if before is None and after is None else "false",
+        page_size=page_size
+    )
+    return html_content
@@ -0,0 +1,147 @@
+"""
+Live admin updates over Server-Sent Events.
+Newly written log entries are rendered once and fanned out to every connected admin page.
+"""
+import asyncio
+import json
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+from admin import render_row, parse_filters
+from storage import entry_matches
+from config import (
+    ADMIN_EVENTS_MAX_CLIENTS, ADMIN_EVENTS_QUEUE_SIZE, ADMIN_EVENTS_HISTORY, ADMIN_EVENTS_HEARTBEAT,
+)
+
+# Sent to a client that fell too far behind; the page reloads itself
+RELOAD_FRAME = b"event: reload\ndata: {}\n\n"
+
+
+class Subscriber:
+    def __init__(self, filters: Dict[str, Any], queue_size: int):
+        self.filters = filters
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def offer(self, entry: Dict[str, Any], frame: bytes) -> None:
+        if self.overflowed or (self.filters and not entry_matches(entry, **self.filters)):
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # Make room for the reload notice; the client re-reads the page anyway
+            self.queue.get_nowait()
+            self.queue.put_nowait(RELOAD_FRAME)
+
+
+class AdminEventHub:
+    """Fans out rendered rows to SSE subscribers; nothing is read from storage per client."""
+
+    def __init__(self, max_clients: int = ADMIN_EVENTS_MAX_CLIENTS, queue_size: int = ADMIN_EVENTS_QUEUE_SIZE,
+                 history: int = ADMIN_EVENTS_HISTORY):
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self.subscribers: Set[Subscriber] = set()
+        # (id, entry, frame) of the most recent rows, for clients resuming with Last-Event-ID
+        self.history: Deque[Tuple[int, Dict[str, Any], bytes]] = deque(maxlen=history)
+        self.published = 0
+        self.overflows = 0
+
+    def publish(self, entries: List[Dict[str, Any]]) -> None:
+        """Render each new entry once and queue it for every subscriber."""
+        for entry in entries:
+            if entry.get("response") is None:
+                # Async job records; the finished job is published when it is written
+                continue
+            row = render_row(entry)
+            if row is None:
+                continue
+            payload = json.dumps({"id": entry["id"], "html": row})
+            frame = f"id: {entry['id']}\nevent: row\ndata: {payload}\n\n".encode()
+            self.history.append((entry["id"], entry, frame))
+            self.published += 1
+            for subscriber in self.subscribers:
+                was_overflowed = subscriber.overflowed
+                subscriber.offer(entry, frame)
+                self.overflows += subscriber.overflowed and not was_overflowed
+
+    def subscribe(self, filters: Dict[str, Any], last_event_id: Optional[int] = None) -> Optional[Subscriber]:
+        """Add a subscriber, replaying rows after last_event_id. Returns None when full."""
+        if len(self.subscribers) >= self.max_clients:
+            return None
+        subscriber = Subscriber(filters, self.queue_size)
+        if last_event_id is not None:
+            if self.history and self.history[0][0] > last_event_id + 1:
+                # Missed more rows than are kept in memory
+                subscriber.queue.put_nowait(RELOAD_FRAME)
+                subscriber.overflowed = True
+            else:
+                for entry_id, entry, frame in self.history:
+                    if entry_id > last_event_id:
+                        subscriber.offer(entry, frame)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def close(self) -> None:
+        """End every stream, e.g. on shutdown."""
+        for subscriber in self.subscribers:
+            try:
+                subscriber.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": len(self.subscribers),
+            "published": self.published,
+            "overflows": self.overflows,
+        }
+
+
+# Shared hub; server.py registers hub.publish as a log writer listener
+admin_events = AdminEventHub()
+
+
+async def handle_admin_events(request: web.Request) -> web.StreamResponse:
+    """Handler for GET /admin/events: streams new rows matching the page's filters."""
+    try:
+        last_event_id: Optional[int] = int(request.headers["Last-Event-ID"])
+    except (KeyError, ValueError):
+        last_event_id = None
+    subscriber = admin_events.subscribe(parse_filters(request.query), last_event_id)
+    if subscriber is None:
+        return web.Response(status=503, text="Too many live admin clients")
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    try:
+        await response.prepare(request)
+        # Reconnect delay for the browser's EventSource, in milliseconds
+        await response.write(b"retry: 3000\n\n")
+        while True:
+            try:
+                frame = await asyncio.wait_for(subscriber.queue.get(), ADMIN_EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                await response.write(b": keep-alive\n\n")
+                continue
+            if frame is None:
+                break
+            await response.write(frame)
+            if frame is RELOAD_FRAME:
+                break
+    except ConnectionResetError:
+        # Client closed the page
+        pass
+    finally:
+        admin_events.unsubscribe(subscriber)
+    return response
@@ -0,0 +1,186 @@
+"""
+Admission control for the scoring endpoint: per-user token-bucket rate limiting
+and a global in-flight limit with a bounded wait queue.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+
+from aiohttp import web
+from pydantic import ValidationError
+
+from handlers import cors_headers, read_fraud_request, BodyTooLarge
+from config import (
+    ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER,
+    RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST, RATE_LIMIT_MAX_KEYS,
+)
+
+# Routes guarded by the middleware
+ADMISSION_PATHS = {"/"}
+
+
+class Rejected(Exception):
+    """Raised when a request is not admitted."""
+
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take one token. Returns 0 on success, otherwise seconds until a token is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, rate: float = RATE_LIMIT_PER_SECOND,
+                 burst: float = RATE_LIMIT_BURST, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+        # Counters
+        self.admitted = 0
+        self.rate_limited = 0
+        self.queue_full = 0
+        self.queue_timeouts = 0
+        self.max_queue_depth = 0
+
+    def share(self, workers: int) -> None:
+        """Give this process its share of the limits when several worker processes each run a controller."""
+        self.max_in_flight = max(1, math.ceil(self.max_in_flight / workers))
+        self.max_queue = max(1, math.ceil(self.max_queue / workers))
+        # A caller's requests are spread across workers, so each enforces a fraction of the rate
+        self.rate = self.rate / workers
+        self.burst = max(1.0, self.burst / workers)
+
+    def check_rate(self, key: str) -> None:
+        """Charge one request to key's token bucket, raising Rejected(429) when it is empty."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        wait = bucket.take(now)
+        if wait:
+            self.rate_limited += 1
+            raise Rejected(429, "Rate limit exceeded", wait)
+
+    async def acquire(self) -> None:
+        """Take an in-flight slot, waiting in the bounded queue if necessary."""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.queue_full += 1
+            raise Rejected(503, "Server busy", ADMISSION_RETRY_AFTER)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        try:
+            # release() hands the slot over directly by resolving the future
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.queue_timeouts += 1
+            raise Rejected(503, "Server busy", ADMISSION_RETRY_AFTER)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the client went away
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # Pass the slot on without decrementing in_flight
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rejected_rate_limited": self.rate_limited,
+            "rejected_queue_full": self.queue_full,
+            "rejected_queue_timeout": self.queue_timeouts,
+            "rate_limit_keys": len(self._buckets),
+        }
+
+
+async def rate_limit_key(request: web.Request) -> str:
+    """user_id from the request body, falling back to the client IP."""
+    user_id: Optional[str] = None
+    try:
+        # The validated body is kept on the request, so the handler does not parse it again
+        user_id = (await read_fraud_request(request)).user_id
+    except (BodyTooLarge, ValidationError):
+        pass
+    if user_id:
+        return f"user:{user_id}"
+    return f"ip:{request.remote or 'unknown'}"
+
+
+def rejection_response(rejected: Rejected) -> web.Response:
+    headers = {**cors_headers, "Retry-After": str(max(1, math.ceil(rejected.retry_after)))}
+    return web.json_response({"error": rejected.reason}, status=rejected.status, headers=headers)
+
+
+# Shared controller used by the middleware
+admission = AdmissionController()
+
+
+@web.middleware
+async def admission_middleware(request: web.Request, handler):
+    if request.method != "POST" or request.path not in ADMISSION_PATHS:
+        return await handler(request)
+    try:
+        admission.check_rate(await rate_limit_key(request))
+        await admission.acquire()
+    except Rejected as rejected:
+        return rejection_response(rejected)
+    try:
+        return await handler(request)
+    finally:
+        admission.release()
@@ -0,0 +1,148 @@
+"""
+Batch scoring: fans a stream of FraudRequest items out to detect_fraudulent_email
+under a concurrency limit and yields results as they complete.
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Iterable, List, Union
+
+from aiohttp import web
+
+from models import FraudRequest
+from fraud_detector import detect_fraudulent_email
+from log_writer import log_writer
+from storage import make_log_entry
+from handlers import cors_headers, read_body, BodyTooLarge
+from config import BATCH_CONCURRENCY, BATCH_MAX_ITEMS, BATCH_PERSIST_CHUNK, BATCH_MAX_BODY_BYTES
+
+
+async def _aiter(items: Union[Iterable[Any], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def score_batch(items: Union[Iterable[Any], AsyncIterator[Any]], concurrency: int = BATCH_CONCURRENCY,
+                      max_items: int = BATCH_MAX_ITEMS) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Score raw request dicts and yield one result per item in completion order.
+
+    Each result is {"index": i, "result": {...}} or {"index": i, "error": "..."}; a bad
+    item never fails the batch. Successful results are persisted in chunks.
+    """
+    inputs: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: asyncio.Queue = asyncio.Queue()
+    pending_entries: List[Dict[str, Any]] = []
+
+    async def produce() -> None:
+        index = 0
+        try:
+            async for item in _aiter(items):
+                if index >= max_items:
+                    await results.put({"index": index, "error": f"Batch exceeds {max_items} items; remaining items ignored"})
+                    break
+                await inputs.put((index, item))
+                index += 1
+        except Exception as e:
+            # Unreadable input stream: report it and score what was already read
+            await results.put({"index": index, "error": f"Invalid batch input: {e}"})
+        finally:
+            for _ in range(concurrency):
+                await inputs.put(None)
+
+    async def work() -> None:
+        while True:
+            job = await inputs.get()
+            if job is None:
+                break
+            index, item = job
+            await results.put(await score_item(index, item))
+
+    async def score_item(index: int, item: Any) -> Dict[str, Any]:
+        try:
+            if isinstance(item, (str, bytes)):
+                item = json.loads(item)
+            request_data = FraudRequest(**item)
+        # ValueError covers ValidationError, JSONDecodeError and undecodable (non-UTF-8) lines;
+        # RecursionError comes from absurdly nested JSON
+        except (ValueError, TypeError, RecursionError) as e:
+            return {"index": index, "error": f"Invalid item: {e}"}
+        try:
+            verdict = await detect_fraudulent_email(
+                request_data.request_text,
+                request_data.latitude,
+                request_data.longitude,
+                request_data.user_id
+            )
+        except Exception as e:
+            return {"index": index, "error": str(e)}
+        response_data = verdict.model_dump()
+        pending_entries.append(make_log_entry(request_data.model_dump(), response_data))
+        return {"index": index, "result": response_data}
+
+    async def persist() -> None:
+        if pending_entries:
+            chunk = pending_entries[:]
+            pending_entries.clear()
+            await log_writer.enqueue_entries(chunk)
+
+    tasks = [asyncio.create_task(produce())] + [asyncio.create_task(work()) for _ in range(concurrency)]
+    done_signal = asyncio.ensure_future(asyncio.gather(*tasks))
+    done_signal.add_done_callback(lambda _: results.put_nowait(None))
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            yield result
+            if len(pending_entries) >= BATCH_PERSIST_CHUNK:
+                await persist()
+        # Surface unexpected failures in the producer or workers
+        await done_signal
+    finally:
+        for task in tasks:
+            task.cancel()
+        await persist()
+
+
+async def iter_ndjson(stream) -> AsyncIterator[bytes]:
+    """Yield non-empty lines from an aiohttp StreamReader."""
+    async for line in stream:
+        line = line.strip()
+        if line:
+            yield line
+
+
+async def handle_batch(request: web.Request) -> web.StreamResponse:
+    """Handles POST /batch with a JSON array or an NDJSON stream of FraudRequest objects."""
+    concurrency = BATCH_CONCURRENCY
+    if request.query.get("concurrency"):
+        try:
+            concurrency = max(1, min(int(request.query["concurrency"]), BATCH_CONCURRENCY))
+        except ValueError:
+            return web.json_response({'error': 'Invalid concurrency'}, status=400, headers=cors_headers)
+
+    if request.content_type in ("application/x-ndjson", "application/jsonl"):
+        # Items are scored while the rest of the body is still arriving
+        items: Any = iter_ndjson(request.content)
+    else:
+        try:
+            items = json.loads(await read_body(request, BATCH_MAX_BODY_BYTES))
+        except BodyTooLarge:
+            return web.json_response(
+                {'error': f'Request body too large (limit {BATCH_MAX_BODY_BYTES} bytes); send larger batches as NDJSON'},
+                status=413, headers=cors_headers)
+        except (ValueError, RecursionError):
+            return web.json_response({'error': 'Invalid JSON format'}, status=400, headers=cors_headers)
+        if not isinstance(items, list):
+            return web.json_response({'error': 'Expected a JSON array of requests'}, status=400, headers=cors_headers)
+
+    response = web.StreamResponse(headers={**cors_headers, 'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    async for result in score_batch(items, concurrency):
+        await response.write(json.dumps(result).encode() + b"\n")
+    await response.write_eof()
+    return response
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Load-testing and benchmark suite for the fraud detection service.
+
+Runs server.main in-process with a FakeOpper in place of the real LLM client and a
+temporary data directory, drives POST / at a fixed concurrency (closed loop) and/or a
+fixed arrival rate (open loop), then measures storage and admin-page costs as the
+request log grows.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+TEMPLATES = [
+    "My {device} stopped working after the update on {day} May. Error code {code}. Can you send a technician?",
+    "I was charged {amount} SEK twice on invoice {code} for the same month, please refund the duplicate charge.",
+    "The {device} battery drains in {day} days even after a reset. Serial number {code}.",
+    "Since {day} April the {device} disconnects from wifi every night and the app shows error {code}.",
+]
+DEVICES = ["motion sensor", "doorbell camera", "smart lock", "alarm panel", "window sensor"]
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], statuses: Dict[int, int], elapsed: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        "requests": sum(statuses.values()),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+class PayloadFactory:
+    """Generates request bodies; repeat_ratio of them reuse an earlier text (cache/coalescing hits)."""
+
+    def __init__(self, seed: int, repeat_ratio: float, users: int):
+        self.rng = random.Random(seed)
+        self.repeat_ratio = repeat_ratio
+        self.users = users
+        self.sent: List[str] = []
+
+    def __call__(self) -> Dict[str, Any]:
+        if self.sent and self.rng.random() < self.repeat_ratio:
+            text = self.rng.choice(self.sent)
+        else:
+            text = self.rng.choice(TEMPLATES).format(
+                device=self.rng.choice(DEVICES),
+                day=self.rng.randint(1, 28),
+                code=self.rng.randint(1000, 999999),
+                amount=self.rng.randint(99, 2999),
+            )
+            if len(self.sent) < 10000:
+                self.sent.append(text)
+        return {
+            "request_text": text,
+            # Inside the default home region so the geofence rule does not short-circuit
+            "latitude": round(self.rng.uniform(55.5, 68.5), 4),
+            "longitude": round(self.rng.uniform(11.5, 23.5), 4),
+            "user_id": f"bench-user-{self.rng.randrange(self.users)}",
+        }
+
+
+async def send(session, url: str, payload: Dict[str, Any], latencies: List[float],
+               statuses: Dict[int, int], started: Optional[float] = None) -> None:
+    started = started if started is not None else time.perf_counter()
+    try:
+        async with session.post(url, json=payload) as response:
+            await response.read()
+            status = response.status
+    except Exception:
+        status = 0
+    latencies.append(time.perf_counter() - started)
+    statuses[status] = statuses.get(status, 0) + 1
+
+
+async def closed_loop(session, url: str, concurrency: int, total: int,
+                      payloads: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """N workers, each sending its next request as soon as the previous one returns."""
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            await send(session, url, payloads(), latencies, statuses)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+async def open_loop(session, url: str, rate: float, duration: float,
+                    payloads: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """Requests sent on a fixed schedule regardless of how fast the server answers.
+
+    Latency is measured from each request's scheduled send time, so a stalled server
+    is not hidden by the generator slowing down (coordinated omission).
+    """
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    tasks = []
+    started = time.perf_counter()
+    total = int(rate * duration)
+    for i in range(total):
+        scheduled = started + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(session, url, payloads(), latencies, statuses, scheduled)))
+    await asyncio.gather(*tasks)
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+async def storage_costs(session, base_url: str, sizes: List[int], payloads: Callable[[], Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Grow the log to each size and time appends, counting and the admin page."""
+    import admin
+    import storage
+    from config import LOG_BATCH_SIZE
+
+    results = []
+    for size in sizes:
+        current = storage.count_requests()
+        append_seconds = 0.0
+        appended = 0
+        while current + appended < size:
+            batch = [
+                storage.make_log_entry(payloads(), {"fraud": 0, "score": 0.1, "comment": "benchmark"})
+                for _ in range(min(LOG_BATCH_SIZE, size - current - appended))
+            ]
+            t0 = time.perf_counter()
+            await asyncio.to_thread(storage.append_entries, batch)
+            append_seconds += time.perf_counter() - t0
+            appended += len(batch)
+
+        t0 = time.perf_counter()
+        count = await asyncio.to_thread(storage.count_requests)
+        count_seconds = time.perf_counter() - t0
+
+        # Time the render itself, then the cached page the next loads are served from
+        admin_ms = []
+        cached_ms = []
+        for _ in range(5):
+            for timings in (admin_ms, cached_ms):
+                if timings is admin_ms:
+                    admin.page_cache.pages.clear()
+                t0 = time.perf_counter()
+                async with session.get(base_url + "/admin") as response:
+                    await response.read()
+                timings.append((time.perf_counter() - t0) * 1000)
+
+        results.append({
+            "log_size": count,
+            "append_us_per_entry": round(append_seconds / appended * 1e6, 2) if appended else None,
+            "count_ms": round(count_seconds * 1000, 2),
+            "admin_page_ms": round(sorted(admin_ms)[len(admin_ms) // 2], 2),
+            "admin_page_cached_ms": round(sorted(cached_ms)[len(cached_ms) // 2], 2),
+        })
+    return results
+
+
+def stage_breakdown() -> Dict[str, float]:
+    """Average server-side time per stage, in milliseconds, from the metrics registry."""
+    from metrics import stage_seconds
+    return {
+        stage: round(series[-1] / sum(series[:-1]) * 1000, 3)
+        for (stage,), series in stage_seconds.values.items() if sum(series[:-1])
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+async def wait_for_ready(session, base_url: str, timeout: float = 30.0) -> None:
+    """Until /readyz reports the warm-up done (requests get 503 before that)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        async with session.get(base_url + "/readyz") as response:
+            if response.status == 200:
+                return
+        if time.monotonic() > deadline:
+            raise TimeoutError("Server did not become ready")
+        await asyncio.sleep(0.05)
+
+
+async def run(args) -> Dict[str, Any]:
+    # Imported here so FRAUD_DATA_DIR is set before config and storage load
+    import aiohttp
+    import server
+    import fraud_detector
+    from config import PRIMARY_MODEL
+    from fake_opper import FakeOpper, LatencyModel
+
+    rng = random.Random(args.seed)
+    models = {}
+    if args.primary_error_rate is not None:
+        models[PRIMARY_MODEL] = {"error_rate": args.primary_error_rate}
+    fraud_detector.set_client(FakeOpper(
+        latency=LatencyModel(args.latency_dist, args.latency_mean, args.latency_spread, rng),
+        error_rate=args.error_rate,
+        models=models,
+        seed=args.seed,
+    ))
+
+    port = free_port()
+    server_task = asyncio.create_task(server.main("127.0.0.1", port))
+    await wait_for_port(port)
+    base_url = f"http://127.0.0.1:{port}"
+    payloads = PayloadFactory(args.seed, args.repeat_ratio, args.users)
+
+    report: Dict[str, Any] = {"config": vars(args)}
+    try:
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_for_ready(session, base_url)
+            if args.mode in ("closed", "both"):
+                report["closed_loop"] = await closed_loop(session, base_url + "/", args.concurrency, args.requests, payloads)
+            if args.mode in ("open", "both"):
+                report["open_loop"] = await open_loop(session, base_url + "/", args.rate, args.duration, payloads)
+            report["stages_avg_ms"] = stage_breakdown()
+            if args.log_sizes:
+                report["storage"] = await storage_costs(session, base_url, args.log_sizes, payloads)
+    finally:
+        server_task.cancel()
+        try:
+            await server_task
+        except asyncio.CancelledError:
+            pass
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    for name in ("closed_loop", "open_loop"):
+        if name in report:
+            r = report[name]
+            print(f"{name}: {r['requests']} requests in {r['elapsed_seconds']}s, {r['throughput_rps']} req/s, "
+                  f"p50 {r['p50_ms']}ms p95 {r['p95_ms']}ms p99 {r['p99_ms']}ms max {r['max_ms']}ms, statuses {r['statuses']}")
+    if report.get("stages_avg_ms"):
+        print("stage averages (ms): " + ", ".join(f"{k}={v}" for k, v in report["stages_avg_ms"].items()))
+    for row in report.get("storage", []):
+        print(f"log size {row['log_size']}: append {row['append_us_per_entry']}us/entry, "
+              f"count {row['count_ms']}ms, admin page {row['admin_page_ms']}ms ({row['admin_page_cached_ms']}ms cached)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fraud detection service against a simulated LLM")
+    parser.add_argument("--mode", choices=["closed", "open", "both"], default="both")
+    parser.add_argument("--concurrency", type=int, default=32, help="Closed loop: concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="Closed loop: total requests")
+    parser.add_argument("--rate", type=float, default=100.0, help="Open loop: requests per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="Open loop: seconds")
+    parser.add_argument("--latency-dist", choices=["constant", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.05, help="Simulated LLM latency mean (seconds)")
+    parser.add_argument("--latency-spread", type=float, default=0.5, help="Uniform half-width, or lognormal sigma")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Simulated failure rate for every model")
+    parser.add_argument("--primary-error-rate", type=float, help="Failure rate for PRIMARY_MODEL only (exercises fallback)")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Share of requests that repeat an earlier text")
+    parser.add_argument("--users", type=int, default=100000, help="Number of distinct user_ids")
+    parser.add_argument("--log-sizes", type=lambda v: [int(x) for x in v.split(",") if x], default=[1000, 10000, 100000],
+                        help="Comma-separated log sizes for the storage/admin phase ('' to skip)")
+    parser.add_argument("--data-dir", help="Data directory to use (default: a fresh temporary directory)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="fraud-bench-") as tmp:
+        os.environ["FRAUD_DATA_DIR"] = args.data_dir or tmp
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        report = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Circuit breaker for the LLM provider, so an outage fails fast instead of tying up
+every request until the client times out.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from config import (
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_CALL_TIMEOUT, CIRCUIT_RESET_TIMEOUT,
+    CIRCUIT_HALF_OPEN_PROBES, CIRCUIT_SUCCESS_THRESHOLD,
+)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+# Numeric state for the metrics gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling the provider while the breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("LLM provider unavailable (circuit open)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker around an async call."""
+
+    def __init__(self, name: str = "llm", failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 call_timeout: float = CIRCUIT_CALL_TIMEOUT, reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+                 half_open_probes: int = CIRCUIT_HALF_OPEN_PROBES,
+                 success_threshold: int = CIRCUIT_SUCCESS_THRESHOLD):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.call_timeout = call_timeout
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.success_threshold = success_threshold
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.probe_successes = 0
+        self.probes_in_flight = 0
+        self.opened_at = 0.0
+
+        # Counters
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        print(f"Circuit breaker '{self.name}': {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self.opened += 1
+            self.opened_at = time.monotonic()
+        self.probe_successes = 0
+
+    def _admit(self) -> bool:
+        """Decide whether a call may go through; returns True if it is a half-open probe."""
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                raise CircuitOpen(self.retry_after())
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_probes:
+                # Let the probes decide; everyone else keeps failing fast
+                raise CircuitOpen(1.0)
+            self.probes_in_flight += 1
+            return True
+        return False
+
+    def _on_success(self) -> None:
+        self.consecutive_failures = 0
+        if self.state == HALF_OPEN:
+            self.probe_successes += 1
+            if self.probe_successes >= self.success_threshold:
+                self._set_state(CLOSED)
+
+    def _on_failure(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._set_state(OPEN)
+
+    async def call(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn() under the breaker. Raises CircuitOpen without calling fn() while open."""
+        try:
+            probe = self._admit()
+        except CircuitOpen:
+            self.rejected += 1
+            raise
+        self.calls += 1
+        try:
+            result = await asyncio.wait_for(fn(), self.call_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._on_failure()
+            raise
+        except asyncio.CancelledError:
+            # The caller went away; that says nothing about the provider
+            raise
+        except Exception:
+            self._on_failure()
+            raise
+        else:
+            self._on_success()
+            return result
+        finally:
+            if probe:
+                self.probes_in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": STATE_VALUES[self.state],
+            "consecutive_failures": self.consecutive_failures,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "opened": self.opened,
+        }
+
+
+# Shared breaker around the LLM provider, used by fraud_detector
+llm_breaker = CircuitBreaker()
@@ -79,6 +79,12 @@ Now analyze the following email and location data. Provide your output in the sa
 # --- LLM Model Configuration ---
 PRIMARY_MODEL = "azure/gpt-4o-eu"
 FALLBACK_MODELS = ["openai/o3-mini"]
+# The server creates the LLM client on startup. With LLM_PREWARM it also makes one
+# scoring call so connections are open before /readyz reports ready. That call is billed
+# like any other, once per worker and again on every worker restart, so it is off by
+# default. The warm-up gives up after LLM_PREWARM_TIMEOUT seconds.
+LLM_PREWARM = os.getenv("LLM_PREWARM", "0") == "1"
+LLM_PREWARM_TIMEOUT = 10.0
 
 # --- Server Configuration ---
 SERVER_HOST = "localhost"
@@ -86,3 +92,247 @@ SERVER_PORT = 3001
 # Allow requests from any origin during development.
 # For production, restrict this to your frontend's actual origin.
 ALLOWED_ORIGIN = "*" # e.g., "http://localhost:5173"
+# Number of server processes. With more than one, server.py pre-forks that many
+# workers sharing the port (see workers.py).
+SERVER_WORKERS = int(os.getenv("FRAUD_WORKERS", "1"))
+# Let each worker bind the port itself with SO_REUSEPORT (Linux spreads connections
+# evenly) instead of sharing one listening socket opened by the parent
+SERVER_REUSE_PORT = os.getenv("FRAUD_REUSE_PORT", "0") == "1"
+# Seconds a worker gets to finish in-flight requests and flush the log after SIGTERM
+WORKER_SHUTDOWN_TIMEOUT = 30.0
+# Scoring requests with a larger body are rejected with 413 before it is parsed
+SERVER_MAX_BODY_BYTES = 64 * 1024
+
+# --- Storage Configuration ---
+# Directory holding the request log and other persisted state
+DATA_DIR = os.getenv("FRAUD_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+# Backend for the request log: "log" (segmented NDJSON files in data/log/) or
+# "sqlite" (indexed database in data/requests.db, better for large histories).
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "log")
+# The request log is stored as newline-delimited JSON segments in data/log/.
+# A new segment is started once the active one grows past this size.
+LOG_SEGMENT_MAX_BYTES = 8 * 1024 * 1024
+# A segment is also closed once it is this old (seconds), so each covers a bounded time range
+LOG_SEGMENT_MAX_AGE = 24 * 3600.0
+# fsync every append so a crash can lose at most the entry being written.
+LOG_FSYNC = True
+# Closed segments are gzip-compressed into data/log/archive/ (listed with their id and
+# time ranges in manifest.json) every LOG_ARCHIVE_INTERVAL seconds. Queries only open
+# the archives their time range or id cursor needs.
+LOG_ARCHIVE_INTERVAL = 300.0
+LOG_ARCHIVE_COMPRESS_LEVEL = 6
+# Gzip can only be read forwards, so newest-first queries decompress a whole archive
+# to read it backwards. The lines of this many recently read archives are kept in
+# memory (up to LOG_SEGMENT_MAX_BYTES each), so paging through one is decompressed once.
+LOG_ARCHIVE_CACHE_SIZE = 2
+# Entries are timestamped when the request is handled but appended later (write-behind,
+# several workers), so the log is only roughly in time order. Queries read this many
+# seconds past the end of their time range before they stop.
+LOG_TIMESTAMP_SKEW = 60.0
+# Retention: archives whose newest entry is older than LOG_RETENTION_DAYS are deleted,
+# then the oldest ones while all archives together exceed LOG_ARCHIVE_MAX_BYTES.
+# 0 disables either limit. With the sqlite backend, rows older than LOG_RETENTION_DAYS are deleted.
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", "0"))
+LOG_ARCHIVE_MAX_BYTES = int(os.getenv("LOG_ARCHIVE_MAX_BYTES", "0"))
+
+# --- Write-Behind Persistence ---
+# Handlers enqueue log entries and return immediately; a background writer
+# flushes them in batches of up to LOG_BATCH_SIZE or every LOG_FLUSH_INTERVAL seconds.
+LOG_QUEUE_MAX_SIZE = 10000
+LOG_BATCH_SIZE = 256
+LOG_FLUSH_INTERVAL = 0.5  # seconds
+# What to do when the queue is full: "block" applies backpressure to the
+# handler until there is room, "drop" discards the entry and counts it.
+LOG_QUEUE_FULL_POLICY = "block"
+# With several workers, each one checks the log this often (seconds) for entries written
+# by the others, so log listeners (admin live updates, user history) see every request
+LOG_FOLLOW_INTERVAL = 1.0
+
+# --- Admin UI Configuration ---
+# Number of requests shown per admin page (overridable with ?page_size=, up to the max)
+ADMIN_PAGE_SIZE = 50
+ADMIN_MAX_PAGE_SIZE = 500
+# Live updates over Server-Sent Events (GET /admin/events). Each client has a queue of
+# ADMIN_EVENTS_QUEUE_SIZE rows; a client that falls further behind is told to reload.
+ADMIN_EVENTS_MAX_CLIENTS = 100
+ADMIN_EVENTS_QUEUE_SIZE = 200
+# Recent rows kept so a reconnecting client (Last-Event-ID) can catch up without a log read
+ADMIN_EVENTS_HISTORY = 500
+ADMIN_EVENTS_HEARTBEAT = 15.0  # seconds between keep-alive comments
+# Rendered admin pages (per query string) kept until a new log entry is written
+ADMIN_PAGE_CACHE_SIZE = 64
+# Admin responses at least this large are gzip/brotli compressed when the client accepts it
+ADMIN_COMPRESS_MIN_BYTES = 1024
+
+# --- Metrics ---
+# With several workers, each writes its metrics to data/metrics/ this often (seconds);
+# snapshots older than METRICS_SNAPSHOT_MAX_AGE (from stopped workers) are ignored
+METRICS_SNAPSHOT_INTERVAL = 5.0
+METRICS_SNAPSHOT_MAX_AGE = 30.0
+
+# --- Verdict Cache ---
+# Repeated submissions (same normalized text from roughly the same place, scored
+# with the same prompt and models) reuse the previous verdict instead of calling the LLM.
+VERDICT_CACHE_ENABLED = True
+VERDICT_CACHE_MAX_ENTRIES = 10000
+VERDICT_CACHE_TTL = 6 * 3600  # seconds
+# Size of the lat/lng grid cells used in the cache key, in degrees
+VERDICT_CACHE_GEO_BUCKET_DEGREES = 0.5
+# Save the cache to data/verdict_cache.json on shutdown and reload it on startup
+VERDICT_CACHE_PERSIST = True
+
+# --- Request Coalescing ---
+# Concurrent requests with the same cache key wait on one shared LLM call
+SINGLE_FLIGHT_ENABLED = True
+
+# --- Local Pre-Screen Rules ---
+# Cheap deterministic checks derived from FRAUD_PROMPT, evaluated before the LLM.
+#   "off":     always ask the LLM
+#   "shadow":  always ask the LLM, but also evaluate the rules and count agreement
+#   "enforce": a rule verdict at or above PRESCREEN_MIN_CONFIDENCE is returned without an LLM call.
+#              Opt-in: only switch once shadow mode shows the rules agree with the LLM
+#              (agreement_rate in the prescreen stats, rule_agreement in /admin/summary)
+PRESCREEN_MODE = os.getenv("PRESCREEN_MODE", "shadow")
+PRESCREEN_MIN_CONFIDENCE = 0.8
+# Home regions as polygons of (latitude, longitude) vertices. A request located
+# outside all of them is flagged. The default box is Sweden's range from FRAUD_PROMPT.
+PRESCREEN_HOME_REGIONS = [
+    [(55.0, 11.0), (55.0, 24.0), (69.0, 24.0), (69.0, 11.0)],
+]
+PRESCREEN_OUTSIDE_REGION_SCORE = 0.9
+# Messages with at most this many words, no digits and no detail keywords are "vague"
+PRESCREEN_VAGUE_MAX_WORDS = 8
+PRESCREEN_VAGUE_SCORE = 0.85
+PRESCREEN_DETAIL_KEYWORDS = [
+    "alarm", "app", "battery", "bill", "camera", "charged", "code", "date", "device",
+    "doorbell", "error", "installation", "invoice", "lock", "motion", "order", "photo",
+    "reset", "sensor", "serial", "technician", "update", "wifi",
+]
+
+# --- Batch Scoring ---
+# Maximum number of items from one batch scored concurrently
+BATCH_CONCURRENCY = 16
+# Maximum number of items accepted in one batch request
+BATCH_MAX_ITEMS = 50000
+# Batch results are handed to the log writer in chunks of this size
+BATCH_PERSIST_CHUNK = 500
+# A JSON array body is read and parsed in memory, so it is limited to this many bytes
+# (413 beyond that). NDJSON bodies are read line by line and have no overall limit.
+BATCH_MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# --- Admission Control ---
+# At most ADMISSION_MAX_IN_FLIGHT scoring requests run at once. Up to ADMISSION_MAX_QUEUE
+# more wait (for at most ADMISSION_QUEUE_TIMEOUT seconds); beyond that requests get a 503.
+ADMISSION_MAX_IN_FLIGHT = 64
+ADMISSION_MAX_QUEUE = 256
+ADMISSION_QUEUE_TIMEOUT = 5.0  # seconds
+ADMISSION_RETRY_AFTER = 1  # seconds, sent with 503 responses
+# Per-user token bucket (keyed by user_id, or client IP when user_id is empty).
+# Over-limit requests get a 429 with Retry-After.
+RATE_LIMIT_PER_SECOND = 1.0
+RATE_LIMIT_BURST = 10
+# Number of idle buckets kept before the least recently used are forgotten
+RATE_LIMIT_MAX_KEYS = 100000
+
+# --- Model Routing ---
+# Models are tried in order (PRIMARY_MODEL, then FALLBACK_MODELS). With hedging on, if
+# the current model has not answered by its ROUTER_HEDGE_PERCENTILE latency the next
+# model is started too; the first good answer wins and the other call is cancelled.
+ROUTER_HEDGE_ENABLED = True
+ROUTER_HEDGE_PERCENTILE = 95
+ROUTER_HEDGE_DEFAULT_DELAY = 3.0  # seconds, used until a model has ROUTER_MIN_SAMPLES latencies
+ROUTER_HEDGE_MIN_DELAY = 0.25  # seconds
+# Rolling window of recent calls per model used for latency percentiles and error rates
+ROUTER_WINDOW = 200
+ROUTER_MIN_SAMPLES = 20
+# A model whose error rate reaches ROUTER_ERROR_THRESHOLD, whose median latency exceeds
+# ROUTER_SLOW_THRESHOLD seconds, or which loses at least ROUTER_HEDGE_LOSS_THRESHOLD of its
+# calls to a hedge (another model answered first) is moved to the back of the order for
+# ROUTER_COOLDOWN seconds. Lost calls count with the time they ran before being cancelled.
+ROUTER_ERROR_THRESHOLD = 0.5
+ROUTER_SLOW_THRESHOLD = 15.0
+ROUTER_HEDGE_LOSS_THRESHOLD = 0.5
+ROUTER_COOLDOWN = 30.0
+
+# --- Circuit Breaker ---
+# Wraps every LLM call. After CIRCUIT_FAILURE_THRESHOLD consecutive failures (errors from
+# every model, or no answer within CIRCUIT_CALL_TIMEOUT seconds) the breaker opens and
+# calls are refused for CIRCUIT_RESET_TIMEOUT seconds. It then lets up to
+# CIRCUIT_HALF_OPEN_PROBES calls through; CIRCUIT_SUCCESS_THRESHOLD successes close it again.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_CALL_TIMEOUT = 20.0
+CIRCUIT_RESET_TIMEOUT = 30.0
+CIRCUIT_HALF_OPEN_PROBES = 1
+CIRCUIT_SUCCESS_THRESHOLD = 2
+# While the breaker is open: "degrade" answers with a local verdict marked source="degraded";
+# "fail" returns 503 with Retry-After
+CIRCUIT_OPEN_POLICY = os.getenv("CIRCUIT_OPEN_POLICY", "degrade")
+# Degraded verdict used when no pre-screen rule applies: not flagged, but with a middling
+# score so it stands out for manual review
+CIRCUIT_DEGRADED_SCORE = 0.5
+
+# --- Async Jobs ---
+# POST / with "Prefer: respond-async" (or ?mode=async) returns 202 and a job id;
+# JOB_WORKERS background workers score queued jobs. New jobs are refused with 503
+# once JOB_MAX_PENDING are waiting.
+JOB_WORKERS = 8
+JOB_MAX_PENDING = 1000
+# Finished jobs are kept for GET /jobs/{id} for JOB_TTL seconds, at most JOB_MAX_ENTRIES of them
+JOB_TTL = 3600.0
+JOB_MAX_ENTRIES = 10000
+# Longest long-poll allowed with GET /jobs/{id}?wait=<seconds>
+JOB_MAX_WAIT = 30.0
+# On startup, jobs accepted within this many seconds and never finished are re-queued
+JOB_RECOVERY_WINDOW = 24 * 3600.0
+
+# --- Customer History ---
+# Requests with a user_id are scored with a short summary of that user's earlier
+# requests (counts, flags, recent scores, timing, location change) from an in-memory
+# index. It is rebuilt from the last HISTORY_REBUILD_DAYS of the request log on startup.
+HISTORY_ENABLED = True
+# Users kept in the index (least recently seen are dropped) and requests kept per user
+HISTORY_MAX_USERS = 100000
+HISTORY_RECENT = 50
+HISTORY_REBUILD_DAYS = 30
+# A request within this many km of the user's previous location counts as the same place
+HISTORY_NEARBY_KM = 50.0
+
+# --- Near-Duplicate Templates ---
+# Stored request texts are grouped into clusters of near-identical messages (MinHash
+# over word shingles with LSH bucketing, see template_index.py).
+#   "off":     no lookup
+#   "hint":    ask the LLM as usual, but tell it the message repeats a known template
+#   "enforce": a request matching a cluster whose LLM verdicts agree gets the cluster's
+#              verdict without an LLM call (source="template"). Opt-in.
+TEMPLATE_MODE = os.getenv("TEMPLATE_MODE", "hint")
+# Estimated Jaccard similarity of word shingles needed to join or match a cluster
+TEMPLATE_SIMILARITY = 0.8
+# A cluster's verdict is reused once it has this many fresh LLM verdicts (not cache
+# hits or coalesced copies), at least
+# TEMPLATE_MIN_AGREEMENT of them on the same side
+TEMPLATE_MIN_VERDICTS = 3
+TEMPLATE_MIN_AGREEMENT = 0.9
+# Shorter texts are too generic to match on
+TEMPLATE_MIN_WORDS = 8
+TEMPLATE_SHINGLE_SIZE = 3
+# MinHash signature length, split into TEMPLATE_BANDS LSH bands
+TEMPLATE_NUM_HASHES = 64
+TEMPLATE_BANDS = 16
+# Clusters kept in memory (least recently matched are dropped) and log entries read on startup
+TEMPLATE_MAX_CLUSTERS = 50000
+TEMPLATE_REBUILD_MAX_ENTRIES = 10000
+# Largest clusters listed on the admin page
+TEMPLATE_ADMIN_TOP = 10
+
+# --- Analytics ---
+# Request log summary served on GET /admin/summary and printed by analytics.py
+ANALYTICS_SCORE_BINS = 10
+# Size of the lat/lng grid cells that requests are grouped by, in degrees
+ANALYTICS_GEO_BUCKET_DEGREES = 1.0
+# Users tracked individually; further users are counted together as "(other)"
+ANALYTICS_MAX_USERS = 100000
+# Entries aggregated (and exported) per chunk
+ANALYTICS_CHUNK_SIZE = 50000
+# Days and top users/buckets included in a report by default
+ANALYTICS_REPORT_DAYS = 30
+ANALYTICS_TOP = 20
@@ -0,0 +1,75 @@
+"""
+Stand-in for opperai.AsyncOpper used by the benchmark suite.
+Simulates LLM latency, failures and per-model behaviour without network access or credits.
+"""
+import asyncio
+import math
+import random
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+
+class LatencyModel:
+    """Latency distribution in seconds: "constant", "uniform" or "lognormal"."""
+
+    def __init__(self, kind: str = "lognormal", mean: float = 0.8, spread: float = 0.5,
+                 rng: Optional[random.Random] = None):
+        if kind not in ("constant", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self.kind = kind
+        self.mean = mean
+        self.spread = spread
+        self.rng = rng or random.Random()
+
+    def sample(self) -> float:
+        if self.kind == "constant":
+            return self.mean
+        if self.kind == "uniform":
+            return max(0.0, self.rng.uniform(self.mean - self.spread, self.mean + self.spread))
+        if self.mean <= 0:
+            return 0.0
+        # lognormal with the requested mean; spread is sigma of the underlying normal
+        mu = math.log(self.mean) - self.spread ** 2 / 2
+        return self.rng.lognormvariate(mu, self.spread)
+
+
+class FakeOpperError(Exception):
+    pass
+
+
+class FakeOpper:
+    """Implements AsyncOpper.call with a configurable latency model and error rate per model."""
+
+    def __init__(self, latency: Optional[LatencyModel] = None, error_rate: float = 0.0,
+                 models: Optional[Dict[str, Dict[str, Any]]] = None, seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.latency = latency or LatencyModel(rng=self.rng)
+        self.error_rate = error_rate
+        # Per-model overrides, e.g. {"azure/gpt-4o-eu": {"error_rate": 0.2, "latency": LatencyModel(...)}}
+        self.models = models or {}
+        self.calls: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def call(self, name: str, instructions: str, input: str, output_type: Any,
+                   model: Optional[str] = None, fallback_models: Optional[list] = None, **kwargs) -> Tuple[Any, None]:
+        # Emulate Opper's server-side fallback when a chain is passed
+        chain = [model, *(fallback_models or [])]
+        for i, candidate in enumerate(chain):
+            try:
+                return await self._call_model(candidate, input, output_type), None
+            except FakeOpperError:
+                if i == len(chain) - 1:
+                    raise
+
+    async def _call_model(self, model: Optional[str], input: str, output_type: Any) -> Any:
+        settings = self.models.get(model, {})
+        latency = settings.get("latency", self.latency)
+        error_rate = settings.get("error_rate", self.error_rate)
+        self.calls[model] = self.calls.get(model, 0) + 1
+        await asyncio.sleep(latency.sample())
+        if self.rng.random() < error_rate:
+            self.errors[model] = self.errors.get(model, 0) + 1
+            raise FakeOpperError(f"Simulated failure from {model}")
+        # Deterministic verdict derived from the input so repeated inputs agree
+        score = (zlib.crc32(input.encode()) % 100) / 100
+        return output_type(fraud=int(score >= 0.66), score=score, comment=f"Simulated verdict from {model}")
@@ -1,36 +1,250 @@
 from opperai import AsyncOpper
-from models import FraudDetection
-from config import FRAUD_PROMPT, PRIMARY_MODEL, FALLBACK_MODELS
-from typing import Optional
+from models import FraudDetection, FraudVerdict
+from config import (
+    FRAUD_PROMPT, VERDICT_CACHE_ENABLED, SINGLE_FLIGHT_ENABLED,
+    PRESCREEN_MODE, CIRCUIT_OPEN_POLICY, CIRCUIT_DEGRADED_SCORE, HISTORY_ENABLED, TEMPLATE_MODE,
+    PRIMARY_MODEL, LLM_PREWARM, LLM_PREWARM_TIMEOUT,
+)
+from verdict_cache import verdict_cache, make_cache_key
+from singleflight import SingleFlight
+from rules import rule_engine
+from metrics import stage_seconds, llm_calls, llm_call_seconds, verdicts
+from model_router import model_router
+from circuit_breaker import CircuitOpen, llm_breaker
+from user_history import user_history
+from template_index import template_index
+from typing import Optional, Tuple
+import asyncio
+import inspect
+import time
 
-# Initialize AsyncOpper - could potentially be enhanced for singleton pattern if needed
-opper = AsyncOpper()
+# One client per process, so its HTTP connections are pooled and reused across requests.
+# Created on first use or by start_client (server startup), closed by close_client.
+opper = None
 
-async def detect_fraudulent_email(customer_email: str, latitude: Optional[float] = None, longitude: Optional[float] = None) -> FraudDetection:
+def get_client():
+    global opper
+    if opper is None:
+        opper = AsyncOpper()
+    return opper
+
+def set_client(client) -> None:
+    """Replace the LLM client, e.g. with fake_opper.FakeOpper for benchmarks."""
+    global opper
+    opper = client
+
+async def start_client() -> None:
+    """
+    Create the LLM client and, with LLM_PREWARM, make one (billed) scoring call so the
+    first real request does not pay for DNS, the TLS handshake and opening the connection
+    pool. A failed warm-up is retried with backoff; the server is not ready until it succeeds.
+    """
+    client = get_client()
+    if not LLM_PREWARM:
+        return
+    delay = 1.0
+    while True:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(client.call(
+                name="FraudDetectionWarmup",
+                instructions=FRAUD_PROMPT,
+                input='Email: "Hi, my door sensor needs a new battery. Which type does it use?"',
+                output_type=FraudDetection,
+                model=PRIMARY_MODEL
+            ), LLM_PREWARM_TIMEOUT)
+        except Exception as e:
+            print(f"LLM client warm-up failed, retrying in {delay:.0f}s: {e!r}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+            continue
+        print(f"LLM client warmed up in {time.perf_counter() - started:.2f}s")
+        return
+
+async def close_client() -> None:
+    """Close the LLM client's connections (server shutdown)."""
+    global opper
+    client, opper = opper, None
+    close = getattr(client, "aclose", None) or getattr(client, "close", None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        print(f"Failed to close the LLM client: {e}")
+
+# Identical requests scored concurrently share one LLM call
+scoring_flight = SingleFlight()
+
+async def detect_fraudulent_email(customer_email: str, latitude: Optional[float] = None, longitude: Optional[float] = None,
+                                  user_id: Optional[str] = None) -> FraudVerdict:
     """
     Analyzes a customer email using OpperAI to detect potential fraud.
 
+    With PRESCREEN_MODE "enforce", clear-cut cases are decided by the local rule engine first.
+    Verdicts are memoized in the verdict cache, so a repeat of a recently scored
+    email from the same area is answered without an LLM call, and concurrent
+    identical requests are coalesced into a single call. While the LLM circuit
+    breaker is open a degraded local verdict is returned (or CircuitOpen raised,
+    see CIRCUIT_OPEN_POLICY). When the user has earlier requests, a summary of
+    them is part of the LLM input (see user_history.py). A near-duplicate of a
+    template whose earlier copies were consistently scored gets their verdict
+    (see TEMPLATE_MODE).
+
     Args:
         customer_email: The text content of the customer's email.
         latitude: Optional latitude of the user's location.
         longitude: Optional longitude of the user's location.
+        user_id: Optional id of the user, used to look up their history.
+
+    Returns:
+        A FraudVerdict object containing the analysis result and its source.
+    """
+    prescreen = None
+    if PRESCREEN_MODE != "off":
+        with stage_seconds.time(stage="prescreen"):
+            prescreen = rule_engine.evaluate(customer_email, latitude, longitude)
+        if prescreen is not None and PRESCREEN_MODE == "enforce":
+            rule_name, rule_verdict = prescreen
+            verdicts.inc(source="rules", model="")
+            return FraudVerdict(**rule_verdict.model_dump(), source="rules", rule=rule_name,
+                                rule_fraud=rule_verdict.fraud)
+
+    # Extra lines for the LLM input. Both change with every logged request (an exact repeat
+    # even joins its own template cluster), so they are left out of the verdict cache key.
+    # A verdict that saw a user's history is only reused for that user, though
+    context = []
+    history_user = None
+    if HISTORY_ENABLED:
+        with stage_seconds.time(stage="history"):
+            history = user_history.summary(user_id, latitude, longitude)
+        if history:
+            context.append(f"Customer history: {history}")
+            history_user = user_id
+
+    if TEMPLATE_MODE != "off":
+        with stage_seconds.time(stage="template"):
+            match = template_index.match(customer_email)
+        if match is not None:
+            cluster, similarity = match
+            if TEMPLATE_MODE == "enforce" and cluster.decided:
+                verdicts.inc(source="template", model="")
+                return FraudVerdict(**cluster.verdict(), source="template", template=cluster.id,
+                                    similarity=round(similarity, 2))
+            context.append(f"Similar messages: {cluster.describe()}")
+
+    try:
+        verdict = await detect_with_llm(customer_email, latitude, longitude, "\n".join(context), history_user)
+    except CircuitOpen:
+        if CIRCUIT_OPEN_POLICY != "degrade":
+            raise
+        verdict = degraded_verdict(prescreen)
+        verdicts.inc(source=verdict.source, model="")
+        return verdict
+    verdicts.inc(source=verdict.source, model=verdict.model or "")
+    if prescreen is not None:
+        # Shadow mode: keep the LLM verdict but record what the rules would have said.
+        # Cached and coalesced copies repeat an LLM verdict already compared
+        rule_name, rule_verdict = prescreen
+        if verdict.reused is None:
+            rule_engine.record_agreement(rule_verdict, verdict)
+        verdict.rule = rule_name
+        verdict.rule_fraud = rule_verdict.fraud
+    return verdict
+
+def degraded_verdict(prescreen: Optional[Tuple[str, FraudDetection]]) -> FraudVerdict:
+    """Local verdict used while the LLM is unavailable: a pre-screen rule's, if one matched."""
+    if prescreen is not None:
+        rule_name, rule_verdict = prescreen
+        return FraudVerdict(**rule_verdict.model_dump(), source="degraded", rule=rule_name,
+                            rule_fraud=rule_verdict.fraud)
+    return FraudVerdict(
+        fraud=0,
+        score=CIRCUIT_DEGRADED_SCORE,
+        comment="Fraud scoring is temporarily unavailable; this request was not analyzed and needs manual review.",
+        source="degraded"
+    )
+
+async def detect_with_llm(customer_email: str, latitude: Optional[float] = None, longitude: Optional[float] = None,
+                          context: str = "", user_id: Optional[str] = None) -> FraudVerdict:
+    """
+    Scores an email with the LLM, going through the verdict cache and request coalescing.
+    context is extra LLM input only; it is not part of the cache key. When it is specific
+    to one user, pass user_id: the verdict is then only cached and shared for that user.
+    """
+    cache_key = make_cache_key(customer_email, latitude, longitude, user_id)
+    if VERDICT_CACHE_ENABLED:
+        with stage_seconds.time(stage="cache"):
+            cached = verdict_cache.get(cache_key)
+        if cached is not None:
+            return FraudVerdict(**{**cached, "reused": "cache"})
+
+    called = False
+
+    async def score() -> FraudVerdict:
+        nonlocal called
+        called = True
+        with stage_seconds.time(stage="llm"):
+            detection, model = await score_with_llm(customer_email, latitude, longitude, context)
+        result = FraudVerdict(**detection.model_dump(), model=model)
+        if VERDICT_CACHE_ENABLED:
+            verdict_cache.put(cache_key, result.model_dump())
+        return result
+
+    if not SINGLE_FLIGHT_ENABLED:
+        return await score()
+    result = await scoring_flight.do(cache_key, score)
+    # Each caller gets its own copy of the shared result; only the caller whose
+    # score() ran has a fresh LLM verdict
+    result = result.model_copy()
+    if not called:
+        result.reused = "coalesced"
+    return result
+
+async def score_with_llm(customer_email: str, latitude: Optional[float] = None, longitude: Optional[float] = None,
+                         context: str = "") -> Tuple[FraudDetection, str]:
+    """
+    Scores an email with OpperAI, bypassing the cache.
+
+    Models are raced by the model router: PRIMARY_MODEL first, with a hedged call to
+    the next model if it is slower than usual or an immediate failover if it errors.
+    Fallback is done here rather than by Opper so we know (and can time) the model
+    that actually answered. context holds extra input lines (customer history,
+    similar messages).
 
     Returns:
-        A FraudDetection object containing the analysis result.
+        The FraudDetection result and the name of the model that produced it.
     """
     geo_part = f"\nLatitude: {latitude}\nLongitude: {longitude}" if latitude is not None and longitude is not None else ""
+    context_part = f"\n{context}" if context else ""
 
     full_input = f"""
-Email: \"{customer_email.strip()}\"{geo_part}
+Email: \"{customer_email.strip()}\"{geo_part}{context_part}
     """
 
-    result, _ = await opper.call(
-        name="FraudDetection",  # A descriptive name for the Opper call
-        instructions=FRAUD_PROMPT,
-        input=full_input,
-        output_type=FraudDetection,
-        model=PRIMARY_MODEL,
-        fallback_models=FALLBACK_MODELS
-    )
+    async def call_model(model: str) -> FraudDetection:
+        started = time.perf_counter()
+        try:
+            result, _ = await get_client().call(
+                name="FraudDetection",  # A descriptive name for the Opper call
+                instructions=FRAUD_PROMPT,
+                input=full_input,
+                output_type=FraudDetection,
+                model=model
+            )
+        except asyncio.CancelledError:
+            # Lost a hedged race
+            llm_calls.inc(model=model, outcome="cancelled")
+            raise
+        except Exception:
+            llm_calls.inc(model=model, outcome="error")
+            raise
+        finally:
+            llm_call_seconds.observe(time.perf_counter() - started, model=model)
+        llm_calls.inc(model=model, outcome="ok")
+        return result
 
-    return result
+    # The breaker sees the outcome across all models, i.e. whether the provider answered at all
+    return await llm_breaker.call(lambda: model_router.call(call_model))
@@ -1,11 +1,17 @@
-import json
+import asyncio
+import math
+import time
 from aiohttp import web
 from pydantic import ValidationError
+from pydantic_core import to_json
 
 from models import FraudRequest, FraudDetection
 from fraud_detector import detect_fraudulent_email
-from storage import save_request
-from config import ALLOWED_ORIGIN
+from circuit_breaker import CircuitOpen
+from jobs import job_manager, JobQueueFull
+from log_writer import log_writer
+from metrics import stage_seconds
+from config import ALLOWED_ORIGIN, JOB_MAX_WAIT, SERVER_MAX_BODY_BYTES
 
 # Define common CORS headers
 cors_headers = {
@@ -14,6 +20,47 @@ cors_headers = {
     'Access-Control-Allow-Headers': 'Content-Type',
 }
 
+class BodyTooLarge(Exception):
+    """Raised when a request body exceeds its size limit (SERVER_MAX_BODY_BYTES for scoring requests)."""
+
+
+async def read_body(request: web.Request, limit: int) -> bytes:
+    """Read the whole body, giving up with BodyTooLarge as soon as it exceeds limit bytes."""
+    if request.content_length is not None and request.content_length > limit:
+        raise BodyTooLarge()
+    body = bytearray()
+    # Bodies without a Content-Length are counted as they arrive
+    async for chunk in request.content.iter_chunked(64 * 1024):
+        body += chunk
+        if len(body) > limit:
+            raise BodyTooLarge()
+    return bytes(body)
+
+
+async def read_fraud_request(request: web.Request) -> FraudRequest:
+    """
+    Reads the body (at most SERVER_MAX_BODY_BYTES) and validates it straight from the
+    raw bytes. The outcome is kept on the request, so admission control (which needs the
+    user_id) and the handler share a single parse.
+
+    Raises BodyTooLarge or pydantic's ValidationError.
+    """
+    if "fraud_request" in request:
+        outcome = request["fraud_request"]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    try:
+        with stage_seconds.time(stage="parse"):
+            body = await read_body(request, SERVER_MAX_BODY_BYTES)
+        with stage_seconds.time(stage="validate"):
+            request["fraud_request"] = FraudRequest.model_validate_json(body)
+    except (BodyTooLarge, ValidationError) as e:
+        request["fraud_request"] = e
+        raise
+    return request["fraud_request"]
+
+
 async def handle_fraud_detection(request: web.Request) -> web.Response:
     """Handles POST requests to the fraud detection endpoint."""
     if request.method != 'POST':
@@ -21,36 +68,44 @@ async def handle_fraud_detection(request: web.Request) -> web.Response:
 
     try:
         # Read and validate request body using Pydantic model
-        raw_data = await request.json()
         try:
-            request_data = FraudRequest(**raw_data)
+            request_data = await read_fraud_request(request)
+        except BodyTooLarge:
+            return web.json_response({'error': f'Request body too large (limit {SERVER_MAX_BODY_BYTES} bytes)'},
+                                     status=413, headers=cors_headers)
         except ValidationError as e:
-             # Provide more specific error for invalid input structure
             error_details = e.errors()
+            if any(error['type'] == 'json_invalid' for error in error_details):
+                return web.json_response({'error': 'Invalid JSON format'}, status=400, headers=cors_headers)
+            # Provide more specific error for invalid input structure
             return web.json_response({'error': 'Invalid request body', 'details': error_details}, status=400, headers=cors_headers)
 
+        if wants_async(request):
+            return await submit_job(request_data)
 
         # Call the fraud detection service
-        fraud_result: FraudDetection = await detect_fraudulent_email(
-            request_data.request_text,
-            request_data.latitude,
-            request_data.longitude
-        )
-
-        # Prepare the response data
-        response_data = fraud_result.model_dump()
-        
-        # Store the request and response in the log file
-        await save_request(
-            request_data.model_dump(),
-            response_data
-        )
+        with stage_seconds.time(stage="detect"):
+            fraud_result: FraudDetection = await detect_fraudulent_email(
+                request_data.request_text,
+                request_data.latitude,
+                request_data.longitude,
+                request_data.user_id
+            )
+
+        # Serialize the response once; the same bytes are sent and written to the log
+        response_body = to_json(fraud_result)
+
+        # Queue the request and response for the background log writer
+        with stage_seconds.time(stage="persist"):
+            await log_writer.enqueue_raw(to_json(request_data), response_body)
         
         # Return the response to the client
-        return web.json_response(response_data, headers=cors_headers)
+        return web.Response(body=response_body, content_type='application/json', headers=cors_headers)
 
-    except json.JSONDecodeError:
-        return web.json_response({'error': 'Invalid JSON format'}, status=400, headers=cors_headers)
+    except CircuitOpen as e:
+        # LLM provider is down and CIRCUIT_OPEN_POLICY is "fail"
+        headers = {**cors_headers, 'Retry-After': str(max(1, math.ceil(e.retry_after)))}
+        return web.json_response({'error': str(e)}, status=503, headers=headers)
     except Exception as e:
         # Log the error for debugging (replace print with proper logging in production)
         print(f"An unexpected error occurred: {e}")
@@ -58,6 +113,56 @@ async def handle_fraud_detection(request: web.Request) -> web.Response:
         return web.json_response({'error': 'Internal server error', 'details': str(e)}, status=500, headers=cors_headers)
 
 
+def wants_async(request: web.Request) -> bool:
+    """Async mode is opt-in with "Prefer: respond-async" (RFC 7240) or ?mode=async."""
+    return "respond-async" in request.headers.get('Prefer', '') or request.query.get('mode') == 'async'
+
+
+async def submit_job(request_data: FraudRequest) -> web.Response:
+    """Queues a request for background scoring and answers 202 with the job id."""
+    try:
+        job = await job_manager.submit(request_data.model_dump())
+    except JobQueueFull as e:
+        return web.json_response({'error': f'Too many pending jobs: {e}'}, status=503,
+                                 headers={**cors_headers, 'Retry-After': '1'})
+    location = f"/jobs/{job.id}"
+    headers = {**cors_headers, 'Location': location, 'Preference-Applied': 'respond-async'}
+    return web.json_response({**job.to_dict(), 'url': location}, status=202, headers=headers)
+
+
+async def handle_job(request: web.Request) -> web.Response:
+    """Handles GET /jobs/{job_id}; ?wait=<seconds> long-polls until the job finishes."""
+    try:
+        wait = min(max(float(request.query.get('wait', 0)), 0.0), JOB_MAX_WAIT)
+    except ValueError:
+        return web.json_response({'error': 'Invalid wait'}, status=400, headers=cors_headers)
+
+    job_id = request.match_info['job_id']
+    job = job_manager.get(job_id)
+    if job is None:
+        return await handle_foreign_job(job_id, wait)
+    if wait > 0 and not job.done.is_set():
+        await job_manager.wait(job, wait)
+
+    if job.done.is_set():
+        return web.json_response(job.to_dict(), headers=cors_headers)
+    return web.json_response(job.to_dict(), status=202, headers={**cors_headers, 'Retry-After': '1'})
+
+
+async def handle_foreign_job(job_id: str, wait: float) -> web.Response:
+    """A job accepted by another worker process (or before a restart): read its state from the job store."""
+    deadline = time.monotonic() + wait
+    data = await job_manager.lookup(job_id)
+    while data is not None and data['status'] in ('pending', 'running') and time.monotonic() < deadline:
+        await asyncio.sleep(min(1.0, deadline - time.monotonic()))
+        data = await job_manager.lookup(job_id)
+    if data is None:
+        return web.json_response({'error': 'Unknown or expired job'}, status=404, headers=cors_headers)
+    if data['status'] in ('pending', 'running'):
+        return web.json_response(data, status=202, headers={**cors_headers, 'Retry-After': '1'})
+    return web.json_response(data, headers=cors_headers)
+
+
 async def handle_options(request: web.Request) -> web.Response:
     """Handles CORS preflight OPTIONS requests."""
     # Simply return 200 OK with the CORS headers
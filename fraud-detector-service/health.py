@@ -0,0 +1,133 @@
+"""
+Liveness and readiness probes for load balancers and orchestrators.
+
+aiohttp only opens the port after every on_startup hook has run, so the slow startup
+work (history and template rebuilds, loading saved state, starting the log writer and
+job workers, the optional LLM warm-up) is not done in on_startup. It is registered here
+as warm-up steps, which run in order in a background task once the server listens:
+
+*   /healthz answers 200 while the process is up and the warm-up has not failed.
+*   /readyz answers 503 while warming up, 200 once every step has finished, and 503
+    again as soon as shutdown begins, so traffic is moved away before in-flight
+    requests are drained.
+*   Every other route answers 503 until the server is ready (readiness_middleware).
+
+Pre-fork workers (workers.py) share the port with the other workers, so they only start
+listening after their warm-up; until then the port is served by the workers already up.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from aiohttp import web
+
+from handlers import cors_headers
+
+Step = Callable[[web.Application], Awaitable[None]]
+
+# Routes served while the server is not ready
+PROBE_PATHS = {"/healthz", "/readyz", "/metrics"}
+
+
+class Readiness:
+    def __init__(self):
+        self.steps: List[Step] = []
+        self.ready = False
+        self.stopping = False
+        self.failed: Optional[str] = None
+        self.started = time.monotonic()
+        self.startup_seconds: Optional[float] = None
+        self._completed: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        # Work running alongside the steps, e.g. the LLM warm-up call
+        self._pending: List[asyncio.Task] = []
+
+    def starting(self) -> None:
+        """Reset for a new application (server.create_app)."""
+        self.__init__()
+
+    def add_step(self, step: Step) -> None:
+        self.steps.append(step)
+
+    def wait_for(self, task: asyncio.Task) -> None:
+        """Don't report ready before task is done as well; its exception fails the warm-up."""
+        self._pending.append(task)
+
+    def finished(self, step: Step) -> bool:
+        """Whether step ran to completion, e.g. before saving state it loaded."""
+        return step.__name__ in self._completed
+
+    async def start(self, app: web.Application) -> None:
+        """on_startup hook: run the steps in the background, after the port is open."""
+        self._task = asyncio.create_task(self._warm_up(app))
+
+    async def wait(self) -> None:
+        """Until the warm-up has finished, successfully or not."""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def stop(self, app: web.Application) -> None:
+        """on_shutdown hook: report not ready, and stop a warm-up still in progress."""
+        self.ready = False
+        self.stopping = True
+        tasks = [task for task in [self._task, *self._pending] if task is not None and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _warm_up(self, app: web.Application) -> None:
+        try:
+            for step in self.steps:
+                await step(app)
+                self._completed.add(step.__name__)
+            await asyncio.gather(*self._pending)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed = f"{type(e).__name__}: {e}"
+            print(f"Startup failed: {self.failed}")
+            return
+        self.ready = True
+        self.startup_seconds = time.monotonic() - self.started
+        print(f"Ready after {self.startup_seconds:.2f}s")
+
+    @property
+    def status(self) -> str:
+        if self.failed:
+            return "failed"
+        if self.stopping:
+            return "stopping"
+        return "ready" if self.ready else "starting"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": int(self.ready),
+            "startup_seconds": self.startup_seconds or 0.0,
+        }
+
+
+# Shared state; server.py registers the warm-up steps and the start/stop hooks
+readiness = Readiness()
+
+
+@web.middleware
+async def readiness_middleware(request: web.Request, handler):
+    if readiness.ready or request.path in PROBE_PATHS or request.method == "OPTIONS":
+        return await handler(request)
+    return web.json_response({"error": f"Server is {readiness.status}"}, status=503,
+                             headers={**cors_headers, "Retry-After": "1"})
+
+
+async def handle_healthz(request: web.Request) -> web.Response:
+    """Liveness: the event loop is answering and the warm-up has not failed."""
+    if readiness.failed:
+        return web.json_response({"status": "failed", "error": readiness.failed}, status=500)
+    return web.json_response({"status": "ok", "pid": os.getpid()})
+
+
+async def handle_readyz(request: web.Request) -> web.Response:
+    """Readiness: 200 once warmed up, 503 while starting, after a failed warm-up or shutting down."""
+    if not readiness.ready:
+        return web.json_response({"status": readiness.status}, status=503, headers={"Retry-After": "1"})
+    return web.json_response({"status": "ready", "startup_seconds": round(readiness.startup_seconds, 3)})
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Import stored fraud detection requests into the SQLite backend.
+Reads either a legacy requests.json array or the segmented request log.
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, Any, Iterator, List
+
+from storage import SQLITE_FILE, SegmentedLogBackend
+from sqlite_storage import SQLiteBackend
+
+def read_json_array(path: Path) -> Iterator[Dict[str, Any]]:
+    """Read entries from a legacy pretty-printed JSON array file."""
+    with open(path, "r") as f:
+        entries = json.load(f)
+    for entry in entries:
+        entry.pop("id", None)
+        yield entry
+
+def read_segmented_log() -> Iterator[Dict[str, Any]]:
+    """Read entries from the segmented request log in data/log/."""
+    for entry in SegmentedLogBackend().query():
+        entry.pop("id", None)
+        yield entry
+
+def main():
+    parser = argparse.ArgumentParser(description="Import stored requests into the SQLite backend")
+    parser.add_argument("--source", type=Path, help="Legacy requests.json file to import (default: the segmented log)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows inserted per transaction")
+    parser.add_argument("--append", action="store_true", help="Import even if the database already has rows")
+    args = parser.parse_args()
+
+    backend = SQLiteBackend(SQLITE_FILE)
+    existing = backend.count()
+    if existing and not args.append:
+        print(f"{SQLITE_FILE} already contains {existing} requests; use --append to import anyway.")
+        return
+
+    entries = read_json_array(args.source) if args.source else read_segmented_log()
+    batch: List[Dict[str, Any]] = []
+    imported = 0
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= args.batch_size:
+            backend.append(batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        backend.append(batch)
+        imported += len(batch)
+
+    print(f"Imported {imported} requests into {SQLITE_FILE}.")
+
+if __name__ == "__main__":
+    main()
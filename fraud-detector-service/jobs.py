@@ -0,0 +1,353 @@
+"""
+Asynchronous scoring jobs: POST / can return 202 with a job id while a bounded pool
+of background workers scores the request.
+
+Each job's latest state is kept in a small file in data/jobs/ (JobStore); a job that
+finishes with a result is also written to the request log, once, like a synchronous
+request. Any worker process can look a job up there, and on startup each process
+re-queues the unfinished jobs it owned (the server, or that worker, stopped first).
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from fraud_detector import detect_fraudulent_email
+from circuit_breaker import CircuitOpen
+from log_writer import log_writer
+from storage import DATA_DIR, make_log_entry
+from config import JOB_WORKERS, JOB_MAX_PENDING, JOB_TTL, JOB_MAX_ENTRIES, JOB_RECOVERY_WINDOW
+
+JOBS_DIR = DATA_DIR / "jobs"
+JOB_ID_RE = re.compile(r"[0-9a-f]{32}")
+# Seconds between sweeps of expired job files
+JOB_EXPIRE_INTERVAL = 60.0
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Raised when JOB_MAX_PENDING jobs are already waiting."""
+
+
+class Job:
+    def __init__(self, job_id: str, request_data: Dict[str, Any]):
+        self.id = job_id
+        self.request = request_data
+        self.status = PENDING
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.finished: Optional[float] = None
+        # Wall-clock time, so it can be compared across restarts
+        self.accepted = time.time()
+        self.done = asyncio.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"job_id": self.id, "status": self.status}
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+    def log_entry(self) -> Dict[str, Any]:
+        """Request log entry recording this job's current state."""
+        entry = make_log_entry(self.request, self.result)
+        entry["job"] = {"id": self.id, "status": self.status}
+        if self.error is not None:
+            entry["job"]["error"] = self.error
+        return entry
+
+
+class JobStore:
+    """
+    Latest state of every job, one JSON file per job, shared by all worker processes.
+    Unfinished jobs live in pending/, finished ones in finished/, and a file's mtime is
+    when the job was accepted or finished. Looking a job up reads one small file however
+    large the request log is, and expiry only lists file names and mtimes. Blocking;
+    called through asyncio.to_thread.
+    """
+
+    def __init__(self, path: Path = JOBS_DIR):
+        self.pending_dir = path / "pending"
+        self.finished_dir = path / "finished"
+        for directory in (self.pending_dir, self.finished_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _name(job_id: str) -> Optional[str]:
+        # Ids come from URLs; anything but our own format cannot name a file
+        if not JOB_ID_RE.fullmatch(job_id):
+            return None
+        return f"{job_id}.json"
+
+    def save(self, state: Dict[str, Any]) -> None:
+        name = self._name(state["job_id"])
+        finished = state["status"] not in (PENDING, RUNNING)
+        path = (self.finished_dir if finished else self.pending_dir) / name
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        # Readers in other processes see the old or the new state, never a partial file
+        os.replace(tmp_path, path)
+        if finished:
+            # Written first, so a reader that misses the pending file finds this one
+            (self.pending_dir / name).unlink(missing_ok=True)
+
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        name = self._name(job_id)
+        if name is None:
+            return None
+        # Pending first: a finishing job is in finished/ before it leaves pending/
+        for directory in (self.pending_dir, self.finished_dir):
+            try:
+                with open(directory / name, "r") as f:
+                    return json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+        return None
+
+    @staticmethod
+    def _files(directory: Path) -> List[Tuple[float, Path]]:
+        """(mtime, path) of the job files in a directory, oldest first."""
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    files.append((entry.stat().st_mtime, Path(entry.path)))
+                except FileNotFoundError:
+                    continue
+        return sorted(files)
+
+    def unfinished(self, window: float = JOB_RECOVERY_WINDOW) -> List[Dict[str, Any]]:
+        """States of jobs accepted within the window that never finished, oldest first."""
+        cutoff = time.time() - window
+        states = []
+        for mtime, path in self._files(self.pending_dir):
+            if mtime < cutoff:
+                continue
+            state = self.load(path.stem)
+            if state is not None and state["status"] in (PENDING, RUNNING):
+                states.append(state)
+        return states
+
+    def expire(self, ttl: float = JOB_TTL, window: float = JOB_RECOVERY_WINDOW,
+               max_entries: int = JOB_MAX_ENTRIES) -> int:
+        """
+        Delete finished jobs older than ttl, then the oldest while more than max_entries
+        are left, and unfinished ones accepted longer than window ago.
+        """
+        now = time.time()
+        finished = self._files(self.finished_dir)
+        expired = [path for mtime, path in finished if now - mtime >= ttl]
+        excess = len(finished) - len(expired) - max_entries
+        if excess > 0:
+            expired += [path for _, path in finished[len(expired):len(expired) + excess]]
+        expired += [path for mtime, path in self._files(self.pending_dir) if now - mtime >= window]
+        deleted = 0
+        for path in expired:
+            try:
+                path.unlink()
+                deleted += 1
+            except FileNotFoundError:
+                # Another process expired it first
+                continue
+        return deleted
+
+
+class JobManager:
+    """Bounded store of jobs plus the worker pool that scores them."""
+
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 ttl: float = JOB_TTL, max_entries: int = JOB_MAX_ENTRIES):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.pending = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.store: Optional[JobStore] = None
+        # With several worker processes: this one's index and the number of them. Each
+        # process re-queues only the unfinished jobs it accepted itself
+        self.process_index = 0
+        self.process_count = 1
+        self._expirer: Optional[asyncio.Task] = None
+
+        # Counters
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.recovered = 0
+        self.rejected = 0
+        self.expired = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def owns(self, state: Dict[str, Any]) -> bool:
+        """Whether this process re-queues the job (also the jobs of worker indexes that no longer exist)."""
+        return state.get("worker", 0) % self.process_count == self.process_index
+
+    async def start(self) -> None:
+        """Re-queue this process's unfinished jobs and start the workers."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        if self.store is None:
+            self.store = JobStore()
+        for state in await asyncio.to_thread(self.store.unfinished):
+            if self.owns(state):
+                job = Job(state["job_id"], state["request"])
+                job.accepted = state["accepted"]
+                self._add(job)
+                self.recovered += 1
+        if self.recovered:
+            print(f"Recovered {self.recovered} unfinished jobs")
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._expirer = asyncio.create_task(self._expire())
+
+    async def stop(self) -> None:
+        """Stop the workers. Unfinished jobs stay pending in the store and are recovered on restart."""
+        tasks = self._tasks + ([self._expirer] if self._expirer is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._expirer = None
+
+    async def _save(self, job: Job) -> None:
+        """Record the job's current state in the store, and its result in the request log."""
+        state = {**job.to_dict(), "request": job.request, "worker": self.process_index, "accepted": job.accepted}
+        await asyncio.to_thread(self.store.save, state)
+        if job.result is not None:
+            await log_writer.enqueue_entry(job.log_entry())
+
+    async def _expire(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.store.expire, self.ttl, JOB_RECOVERY_WINDOW, self.max_entries)
+            except Exception as e:
+                print(f"Failed to expire job files: {e}")
+            await asyncio.sleep(JOB_EXPIRE_INTERVAL)
+
+    async def submit(self, request_data: Dict[str, Any]) -> Job:
+        """Accept a request for background scoring. Raises JobQueueFull when at capacity."""
+        if not self.running:
+            raise RuntimeError("Job workers are not running")
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise JobQueueFull(f"{self.pending} jobs already pending")
+        job = Job(uuid.uuid4().hex, request_data)
+        # Record the job before queueing it so a restart can find it
+        await self._save(job)
+        self._add(job)
+        self.submitted += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job is not None and job.finished is not None and time.monotonic() - job.finished >= self.ttl:
+            self._evict()
+            return None
+        return job
+
+    async def lookup(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Latest state of a job this process does not hold (another worker's, or a previous run's)."""
+        if self.store is None:
+            return None
+        state = await asyncio.to_thread(self.store.load, job_id)
+        if state is None:
+            return None
+        return {key: value for key, value in state.items() if key in ("job_id", "status", "result", "error")}
+
+    async def wait(self, job: Job, timeout: float) -> bool:
+        """Wait up to timeout seconds for the job to finish. Returns whether it has."""
+        try:
+            await asyncio.wait_for(job.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job.done.is_set()
+
+    def _add(self, job: Job) -> None:
+        self.jobs[job.id] = job
+        self.pending += 1
+        self._queue.put_nowait(job)
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop expired finished jobs, and the oldest finished ones while over max_entries."""
+        now = time.monotonic()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished is None:
+                # Unfinished jobs are never evicted
+                continue
+            if len(self.jobs) > self.max_entries or now - job.finished >= self.ttl:
+                del self.jobs[job_id]
+                self.expired += 1
+            else:
+                break
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished = time.monotonic()
+        self.pending -= 1
+        job.done.set()
+
+    def _requeue(self, job: Job) -> None:
+        self._queue.put_nowait(job)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status = RUNNING
+            request = job.request
+            try:
+                verdict = await detect_fraudulent_email(
+                    request["request_text"],
+                    request.get("latitude"),
+                    request.get("longitude"),
+                    request.get("user_id")
+                )
+            except CircuitOpen as e:
+                # The LLM is down and CIRCUIT_OPEN_POLICY is "fail": try again once the breaker may close
+                job.status = PENDING
+                asyncio.get_running_loop().call_later(max(1.0, e.retry_after), self._requeue, job)
+                continue
+            except Exception as e:
+                job.error = str(e)
+                self._finish(job, FAILED)
+                self.failed += 1
+            else:
+                job.result = verdict.model_dump()
+                self._finish(job, DONE)
+                self.completed += 1
+            await self._save(job)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "stored": len(self.jobs),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "recovered": self.recovered,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
+
+
+# Shared job manager; started and stopped by server.py
+job_manager = JobManager()
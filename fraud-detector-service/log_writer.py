@@ -0,0 +1,241 @@
+"""
+Write-behind persistence for the request log.
+Handlers enqueue entries and return; a background task flushes them in batches.
+Another periodically archives closed log segments and applies retention.
+"""
+import asyncio
+import time
+from typing import Callable, Dict, Any, List, Optional
+
+from storage import append_entries, make_raw_log_entry, last_entry_id, query_requests, maintain_log
+from config import (
+    LOG_QUEUE_MAX_SIZE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, LOG_QUEUE_FULL_POLICY, LOG_FOLLOW_INTERVAL,
+    LOG_ARCHIVE_INTERVAL,
+)
+
+
+class RequestLogWriter:
+    """Bounded queue plus a single background task that writes batches in a worker thread."""
+
+    def __init__(self, max_size: int = LOG_QUEUE_MAX_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL, full_policy: str = LOG_QUEUE_FULL_POLICY):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.full_policy = full_policy
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Called on the event loop with each batch once it is written (entries have their ids)
+        self.listeners: List[Callable[[List[Dict[str, Any]]], None]] = []
+        # With several worker processes, listeners are fed by polling the shared log
+        # instead of by this process's writes (see follow_log)
+        self.follow_interval: Optional[float] = None
+        self._follower: Optional[asyncio.Task] = None
+        # Seconds between archiving/retention runs; None disables them in this process
+        self.maintenance_interval: Optional[float] = LOG_ARCHIVE_INTERVAL
+        self._maintainer: Optional[asyncio.Task] = None
+
+        # Counters
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self.archived = 0
+        self.archives_deleted = 0
+
+    def add_listener(self, listener: Callable[[List[Dict[str, Any]]], None]) -> None:
+        """Register a callback for newly written entries, e.g. to push them to admin clients."""
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def follow_log(self, interval: float = LOG_FOLLOW_INTERVAL) -> None:
+        """Notify listeners of entries written by any process, not just this one."""
+        self.follow_interval = interval
+
+    def _notify(self, entries: List[Dict[str, Any]], local: bool = True) -> None:
+        if local and self.follow_interval is not None:
+            # The follower reports them along with other processes' entries
+            return
+        for listener in self.listeners:
+            try:
+                listener(entries)
+            except Exception as e:
+                print(f"Log listener failed: {e}")
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        """Start the background writer task."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._task = asyncio.create_task(self._run())
+        if self.follow_interval is not None:
+            self._follower = asyncio.create_task(self._follow())
+        if self.maintenance_interval is not None:
+            self._maintainer = asyncio.create_task(self._maintain())
+
+    async def stop(self) -> None:
+        """Flush everything still queued, then stop the writer."""
+        if not self.running:
+            return
+        # A None sentinel tells the writer to drain and exit
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        for task in (self._follower, self._maintainer):
+            if task is not None:
+                task.cancel()
+        self._follower = self._maintainer = None
+
+    async def enqueue_raw(self, request_json: bytes, response_json: bytes) -> bool:
+        """Queue a request and its response (already JSON) for persistence. Returns False if it was dropped."""
+        return await self.enqueue_entry(make_raw_log_entry(request_json, response_json))
+
+    async def enqueue_entry(self, entry: Dict[str, Any]) -> bool:
+        if not self.running:
+            # Writer not started (e.g. command-line use); write through instead
+            await asyncio.to_thread(append_entries, [entry])
+            self.written += 1
+            self._notify([entry])
+            return True
+
+        if self.full_policy == "drop":
+            try:
+                self._queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                return False
+        else:
+            # Backpressure: wait for the writer to make room
+            await self._queue.put(entry)
+
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    async def enqueue_entries(self, entries: List[Dict[str, Any]]) -> int:
+        """Queue several entries at once. Returns how many were accepted."""
+        if not self.running:
+            # Write through as a single batch
+            await asyncio.to_thread(append_entries, entries)
+            self.written += len(entries)
+            self._notify(entries)
+            return len(entries)
+        accepted = 0
+        for entry in entries:
+            accepted += await self.enqueue_entry(entry)
+        return accepted
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of queue depth and flush counters."""
+        return {
+            "queue_depth": self.queue_depth,
+            "queue_max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "avg_flush_seconds": self.total_flush_seconds / self.batches if self.batches else 0.0,
+            "archived": self.archived,
+            "archives_deleted": self.archives_deleted,
+        }
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            entry = await self._queue.get()
+            if entry is None:
+                break
+            batch = [entry]
+            deadline = time.monotonic() + self.flush_interval
+            # Collect more entries until the batch is full or the flush interval elapses
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            await self._flush(batch)
+
+        # Drain whatever was queued behind the sentinel
+        remaining: List[Dict[str, Any]] = []
+        while not self._queue.empty():
+            entry = self._queue.get_nowait()
+            if entry is not None:
+                remaining.append(entry)
+        for i in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[i:i + self.batch_size])
+
+    async def _follow(self) -> None:
+        """Hand entries written by any process to the listeners: one log read per poll."""
+        seen = await asyncio.to_thread(last_entry_id)
+        while True:
+            await asyncio.sleep(self.follow_interval)
+            try:
+                if await asyncio.to_thread(last_entry_id) <= seen:
+                    continue
+                while True:
+                    entries = await asyncio.to_thread(
+                        lambda: list(query_requests(after_id=seen, limit=self.batch_size, include_pending=True)))
+                    if not entries:
+                        break
+                    seen = entries[-1]["id"]
+                    self._notify(entries, local=False)
+                    if len(entries) < self.batch_size:
+                        break
+            except Exception as e:
+                print(f"Failed to read new log entries: {e}")
+
+    async def _maintain(self) -> None:
+        """Archive closed segments and apply retention, first right after startup."""
+        while True:
+            try:
+                done = await asyncio.to_thread(maintain_log)
+            except Exception as e:
+                print(f"Log maintenance failed: {e}")
+            else:
+                self.archived += done.get("archived", 0)
+                self.archives_deleted += done.get("deleted", 0)
+            await asyncio.sleep(self.maintenance_interval)
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(append_entries, batch)
+        except Exception as e:
+            # Keep the writer alive; a failed batch is counted rather than retried forever
+            self.failed += len(batch)
+            print(f"Failed to write {len(batch)} log entries: {e}")
+            return
+        elapsed = time.perf_counter() - started
+        self.batches += 1
+        self.written += len(batch)
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.total_flush_seconds += elapsed
+        self._notify(batch)
+
+
+# Shared writer used by the request handlers; started and stopped by server.main
+log_writer = RequestLogWriter()
@@ -0,0 +1,261 @@
+"""
+Lightweight in-process metrics rendered in the Prometheus text format.
+Recording is a dict lookup and a few additions, so it is cheap enough for every request.
+
+With several server processes, each one periodically writes a snapshot of its metrics
+to a shared directory and /metrics adds up the snapshots of all of them.
+"""
+import asyncio
+import json
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from config import METRICS_SNAPSHOT_MAX_AGE
+
+# Latency buckets in seconds, from sub-millisecond parsing up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def merge(self, values: Dict[LabelValues, float], other: List[Tuple[List[str], float]]) -> None:
+        """Add a snapshot's values (as produced by Registry.snapshot) into values."""
+        for key, value in other:
+            key = tuple(key)
+            values[key] = values.get(key, 0.0) + value
+
+    def render(self, values: Optional[Dict[LabelValues, float]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in (self.values if values is None else values).items():
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self.values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def merge(self, values: Dict[LabelValues, List[float]], other: List[Tuple[List[str], List[float]]]) -> None:
+        for key, series in other:
+            key = tuple(key)
+            if key in values:
+                values[key] = [a + b for a, b in zip(values[key], series)]
+            else:
+                values[key] = list(series)
+
+    def render(self, values: Optional[Dict[LabelValues, List[float]]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in (self.values if values is None else values).items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Any] = []
+        # Components that already keep their own counters expose them through stats()
+        self.stats_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        # Set in multi-process mode (see enable_aggregation)
+        self.snapshot_dir: Optional[Path] = None
+        self.worker_id: Optional[int] = None
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix: str, stats: Callable[[], Dict[str, Any]]) -> None:
+        """Export every numeric value of stats() as a gauge named fraud_<prefix>_<key>."""
+        self.stats_sources[prefix] = stats
+
+    def enable_aggregation(self, snapshot_dir: Path, worker_id: int) -> None:
+        """Share metrics with the other worker processes through snapshot files in snapshot_dir."""
+        self.snapshot_dir = Path(snapshot_dir)
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        self.worker_id = worker_id
+
+    def snapshot(self) -> Dict[str, Any]:
+        """This process's metric values and component stats in a JSON-serializable form."""
+        return {
+            "worker": self.worker_id,
+            "time": time.time(),
+            "metrics": {metric.name: [[list(key), value] for key, value in metric.values.items()]
+                        for metric in self.metrics},
+            "stats": {prefix: stats() for prefix, stats in self.stats_sources.items()},
+        }
+
+    def write_snapshot(self, snapshot: Optional[Dict[str, Any]] = None) -> None:
+        """Write a snapshot (taken now if not given) for the other workers to read."""
+        if self.snapshot_dir is None:
+            return
+        path = self.snapshot_dir / f"worker-{self.worker_id}.json"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot if snapshot is not None else self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def load_snapshots(self) -> List[Dict[str, Any]]:
+        """Recent snapshots written by the other workers."""
+        if self.snapshot_dir is None:
+            return []
+        snapshots = []
+        now = time.time()
+        for path in self.snapshot_dir.glob("worker-*.json"):
+            try:
+                with open(path, "r") as f:
+                    snapshot = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            # Skip our own (rendered live) and those of workers that stopped
+            if snapshot.get("worker") != self.worker_id and now - snapshot.get("time", 0) <= METRICS_SNAPSHOT_MAX_AGE:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def render(self, others: Sequence[Dict[str, Any]] = ()) -> str:
+        """Render this process's metrics, plus other workers' snapshots if given.
+
+        Counters and histograms are summed across workers; component stats are kept
+        per worker with a worker label, as not all of them can be added up.
+        """
+        lines: List[str] = []
+        for metric in self.metrics:
+            values = None
+            if others:
+                values = {key: (list(value) if isinstance(value, list) else value)
+                          for key, value in metric.values.items()}
+                for snapshot in others:
+                    metric.merge(values, snapshot["metrics"].get(metric.name, []))
+            lines.extend(metric.render(values))
+
+        sources = [(self.worker_id, {prefix: stats() for prefix, stats in self.stats_sources.items()})]
+        sources += [(snapshot["worker"], snapshot["stats"]) for snapshot in others]
+        # Every series of a gauge has to be listed together, so group by name first
+        gauges: Dict[str, List[str]] = {}
+        for worker, all_stats in sources:
+            worker_label = [("worker", worker)] if self.worker_id is not None else []
+            for prefix, stats in all_stats.items():
+                for key, value in stats.items():
+                    if isinstance(value, dict):
+                        # e.g. per-rule hit counts become one labelled series
+                        series = [([("key", label)] + worker_label, item) for label, item in value.items()]
+                    elif isinstance(value, (int, float)):
+                        series = [(worker_label, value)]
+                    else:
+                        continue
+                    gauge = gauges.setdefault(f"fraud_{prefix}_{key}", [])
+                    for labels, item in series:
+                        names = [label for label, _ in labels]
+                        gauge.append(f"{_format_labels(names, [v for _, v in labels])} {float(item)}")
+        for name, series_lines in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(name + line for line in series_lines)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Per-stage latency of the scoring path
+stage_seconds = registry.histogram(
+    "fraud_stage_seconds", "Time spent in each stage of handling a scoring request", ["stage"])
+http_requests = registry.counter(
+    "fraud_http_requests_total", "HTTP requests by route, method and status code", ["route", "method", "status"])
+http_request_seconds = registry.histogram(
+    "fraud_http_request_seconds", "End-to-end HTTP request latency by route", ["route"])
+llm_calls = registry.counter(
+    "fraud_llm_calls_total", "LLM calls by model and outcome", ["model", "outcome"])
+llm_call_seconds = registry.histogram(
+    "fraud_llm_call_seconds", "LLM call latency by model", ["model"])
+verdicts = registry.counter(
+    "fraud_verdicts_total", "Verdicts returned by source and answering model", ["source", "model"])
+
+
+def route_label(request: web.Request) -> str:
+    """Use the route pattern rather than the raw path to keep label cardinality bounded."""
+    route = request.match_info.route
+    resource = getattr(route, "resource", None)
+    return resource.canonical if resource is not None else "unmatched"
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        route = route_label(request)
+        http_requests.inc(route=route, method=request.method, status=status)
+        http_request_seconds.observe(time.perf_counter() - started, route=route)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Prometheus scrape endpoint. In multi-process mode it reports all workers combined."""
+    others = await asyncio.to_thread(registry.load_snapshots) if registry.snapshot_dir is not None else []
+    return web.Response(body=registry.render(others).encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
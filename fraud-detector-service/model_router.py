@@ -0,0 +1,178 @@
+"""
+Latency-aware routing between PRIMARY_MODEL and FALLBACK_MODELS with hedged requests.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import (
+    PRIMARY_MODEL, FALLBACK_MODELS, ROUTER_HEDGE_ENABLED, ROUTER_HEDGE_PERCENTILE, ROUTER_HEDGE_DEFAULT_DELAY,
+    ROUTER_HEDGE_MIN_DELAY, ROUTER_WINDOW, ROUTER_MIN_SAMPLES, ROUTER_ERROR_THRESHOLD, ROUTER_SLOW_THRESHOLD,
+    ROUTER_COOLDOWN, ROUTER_HEDGE_LOSS_THRESHOLD,
+)
+
+
+class ModelHealth:
+    """Rolling latency and error history for one model."""
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        # Completed calls only: latencies of good answers (the hedge delay) and outcomes
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        # Every attempt, including hedge races it lost and was cut off in: the time it took,
+        # or at least took, and whether it lost. Only used to decide if the model is slow
+        self.elapsed: Deque[float] = deque(maxlen=window)
+        self.losses: Deque[bool] = deque(maxlen=window)
+        self.degraded_until = 0.0
+        self.answers = 0
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+        self.elapsed.append(latency)
+        self.losses.append(False)
+
+    def record_loss(self, elapsed: float) -> None:
+        """A call cancelled because another model answered first, after elapsed seconds."""
+        self.elapsed.append(elapsed)
+        self.losses.append(True)
+
+    def slow(self) -> bool:
+        """Median attempt time (a lower bound for lost races) above ROUTER_SLOW_THRESHOLD,
+        or most attempts lost to a hedge."""
+        ordered = sorted(self.elapsed)
+        return (ordered[len(ordered) // 2] > ROUTER_SLOW_THRESHOLD
+                or self.losses.count(True) / len(self.losses) >= ROUTER_HEDGE_LOSS_THRESHOLD)
+
+    def clear(self) -> None:
+        for history in (self.latencies, self.outcomes, self.elapsed, self.losses):
+            history.clear()
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.latencies) < ROUTER_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def degraded(self, now: float) -> bool:
+        return now < self.degraded_until
+
+
+class ModelRouter:
+    """Orders models by health and races them with hedged requests."""
+
+    def __init__(self, models: Optional[List[str]] = None, hedge: bool = ROUTER_HEDGE_ENABLED):
+        self.models = models or [PRIMARY_MODEL, *FALLBACK_MODELS]
+        self.hedge = hedge
+        self.health: Dict[str, ModelHealth] = {model: ModelHealth() for model in self.models}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def order(self) -> List[str]:
+        """Configured order, with currently degraded models moved to the back."""
+        now = time.monotonic()
+        return sorted(self.models, key=lambda model: self.health[model].degraded(now))
+
+    def hedge_delay(self, model: str) -> float:
+        p = self.health[model].percentile(ROUTER_HEDGE_PERCENTILE)
+        return max(ROUTER_HEDGE_MIN_DELAY, p if p is not None else ROUTER_HEDGE_DEFAULT_DELAY)
+
+    def record(self, model: str, latency: float, ok: bool) -> None:
+        self.health[model].record(latency, ok)
+        self._check(model)
+
+    def record_loss(self, model: str, elapsed: float) -> None:
+        self.health[model].record_loss(elapsed)
+        self._check(model)
+
+    def _check(self, model: str) -> None:
+        """Degrade the model if it errors too often or is too slow."""
+        health = self.health[model]
+        if len(health.losses) < ROUTER_MIN_SAMPLES or health.degraded(time.monotonic()):
+            return
+        if health.error_rate() >= ROUTER_ERROR_THRESHOLD or health.slow():
+            health.degraded_until = time.monotonic() + ROUTER_COOLDOWN
+            # Start afresh after the cooldown instead of re-tripping on old samples
+            health.clear()
+            print(f"Model {model} degraded; deprioritized for {ROUTER_COOLDOWN}s")
+
+    async def call(self, call_model: Callable[[str], Awaitable[Any]]) -> Tuple[Any, str]:
+        """Run call_model(model) across models and return (first good result, model)."""
+        order = self.order()
+        # task -> (model, start time, launched as a hedge)
+        pending: Dict[asyncio.Task, Tuple[str, float, bool]] = {}
+        next_index = 0
+        last_error: Optional[BaseException] = None
+        answered = False
+
+        def launch(hedged: bool) -> None:
+            nonlocal next_index
+            model = order[next_index]
+            next_index += 1
+            pending[asyncio.create_task(call_model(model))] = (model, time.monotonic(), hedged)
+
+        launch(False)
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and next_index < len(order):
+                    # Hedge once the newest attempt is slower than its usual tail latency
+                    newest_model, newest_started, _ = list(pending.values())[-1]
+                    timeout = max(0.0, newest_started + self.hedge_delay(newest_model) - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    launch(True)
+                    continue
+                for task in done:
+                    model, started, hedged = pending.pop(task)
+                    error = task.exception()
+                    self.record(model, time.monotonic() - started, error is None)
+                    if error is None:
+                        self.health[model].answers += 1
+                        self.hedge_wins += hedged
+                        answered = True
+                        return task.result(), model
+                    last_error = error
+                if not pending and next_index < len(order):
+                    # Every attempt so far failed: fail over immediately
+                    self.failovers += 1
+                    launch(False)
+            raise last_error
+        finally:
+            # Calls still running lost the race, or the caller went away. Their latency
+            # is unknown, only a lower bound, so it stays out of the percentiles the hedge
+            # delay is based on. A lost race still counts towards degrading a slow model
+            now = time.monotonic()
+            for task, (model, started, _) in pending.items():
+                if task.done():
+                    if not task.cancelled():
+                        task.exception()
+                    continue
+                task.cancel()
+                if answered:
+                    self.record_loss(model, now - started)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "answers": {model: health.answers for model, health in self.health.items()},
+            "p50_seconds": {model: health.percentile(50) or 0.0 for model, health in self.health.items()},
+            "p95_seconds": {model: health.percentile(95) or 0.0 for model, health in self.health.items()},
+            "error_rate": {model: health.error_rate() for model, health in self.health.items()},
+            "hedge_losses": {model: health.losses.count(True) for model, health in self.health.items()},
+            "degraded": {model: int(health.degraded(now)) for model, health in self.health.items()},
+        }
+
+
+# Shared router used by fraud_detector
+model_router = ModelRouter()
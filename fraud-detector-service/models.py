@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 
 # Define the output structure for fraud detection
 class FraudDetection(BaseModel):
@@ -11,4 +12,15 @@ class FraudRequest(BaseModel):
     request_text: str
     latitude: float = 0.0  # Default value if not provided
     longitude: float = 0.0  # Default value if not provided
-    user_id: str = ""  # Optional field for user identification
\ No newline at end of file
+    user_id: str = ""  # Optional field for user identification
+
+# Verdict returned by detect_fraudulent_email, annotated with where it came from.
+# Kept separate from FraudDetection so the LLM output schema is unchanged.
+class FraudVerdict(FraudDetection):
+    source: str = "llm"  # "llm", "rules", "template" or "degraded"
+    rule: Optional[str] = None  # Name of the pre-screen rule that fired, if any
+    rule_fraud: Optional[int] = None  # That rule's fraud flag (also set in shadow mode)
+    model: Optional[str] = None  # LLM model that produced the verdict
+    template: Optional[int] = None  # Near-duplicate cluster whose verdict was reused
+    similarity: Optional[float] = None  # Estimated similarity to that cluster
+    reused: Optional[str] = None  # "cache" or "coalesced" when an earlier LLM verdict was handed out again
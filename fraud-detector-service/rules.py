@@ -0,0 +1,140 @@
+"""
+Deterministic pre-screen rules evaluated before the LLM.
+Each rule encodes a clear-cut case from FRAUD_PROMPT and returns a verdict only when it applies.
+"""
+import re
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+from models import FraudDetection
+from config import (
+    PRESCREEN_MIN_CONFIDENCE, PRESCREEN_HOME_REGIONS, PRESCREEN_OUTSIDE_REGION_SCORE,
+    PRESCREEN_VAGUE_MAX_WORDS, PRESCREEN_VAGUE_SCORE, PRESCREEN_DETAIL_KEYWORDS,
+)
+
+Polygon = Sequence[Tuple[float, float]]
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def point_in_polygon(latitude: float, longitude: float, polygon: Polygon) -> bool:
+    """Ray-casting test treating longitude as x and latitude as y. Edges count as inside."""
+    inside = False
+    n = len(polygon)
+    for i in range(n):
+        lat1, lng1 = polygon[i]
+        lat2, lng2 = polygon[(i + 1) % n]
+        if min(lat1, lat2) <= latitude <= max(lat1, lat2) and min(lng1, lng2) <= longitude <= max(lng1, lng2):
+            # On a horizontal or vertical edge
+            if lat1 == lat2 or lng1 == lng2:
+                return True
+        if (lat1 > latitude) != (lat2 > latitude):
+            crossing = lng1 + (latitude - lat1) * (lng2 - lng1) / (lat2 - lat1)
+            if longitude < crossing:
+                inside = not inside
+    return inside
+
+
+def has_location(latitude: Optional[float], longitude: Optional[float]) -> bool:
+    # FraudRequest defaults both coordinates to 0.0 when the client sends none
+    return latitude is not None and longitude is not None and (latitude, longitude) != (0.0, 0.0)
+
+
+class Rule:
+    """A single pre-screen check."""
+    name = "rule"
+
+    def evaluate(self, text: str, latitude: Optional[float], longitude: Optional[float]) -> Optional[FraudDetection]:
+        raise NotImplementedError
+
+
+class GeofenceRule(Rule):
+    """Flags requests sent from outside every home region."""
+    name = "geofence"
+
+    def __init__(self, regions: List[Polygon] = PRESCREEN_HOME_REGIONS, score: float = PRESCREEN_OUTSIDE_REGION_SCORE):
+        self.regions = regions
+        self.score = score
+
+    def evaluate(self, text, latitude, longitude):
+        if not self.regions or not has_location(latitude, longitude):
+            return None
+        if any(point_in_polygon(latitude, longitude, region) for region in self.regions):
+            return None
+        return FraudDetection(
+            fraud=1,
+            score=self.score,
+            comment=f"Request sent from outside the service region ({latitude}, {longitude})."
+        )
+
+
+class VagueMessageRule(Rule):
+    """Flags very short messages with no specific detail."""
+    name = "vague_message"
+
+    def __init__(self, max_words: int = PRESCREEN_VAGUE_MAX_WORDS, score: float = PRESCREEN_VAGUE_SCORE,
+                 detail_keywords: List[str] = PRESCREEN_DETAIL_KEYWORDS):
+        self.max_words = max_words
+        self.score = score
+        self.detail_keywords = frozenset(detail_keywords)
+
+    def evaluate(self, text, latitude, longitude):
+        words = WORD_RE.findall(text.lower())
+        if len(words) > self.max_words:
+            return None
+        if any(word.isdigit() or word in self.detail_keywords for word in words):
+            return None
+        return FraudDetection(
+            fraud=1,
+            score=self.score,
+            comment="Message is vague and lacks any technical or situational detail."
+        )
+
+
+class RuleEngine:
+    """Evaluates rules in order and returns the first confident verdict."""
+
+    def __init__(self, rules: Optional[List[Rule]] = None, min_confidence: float = PRESCREEN_MIN_CONFIDENCE):
+        self.rules = rules if rules is not None else [GeofenceRule(), VagueMessageRule()]
+        self.min_confidence = min_confidence
+        self.evaluated = 0
+        self.decided = 0
+        self.rule_hits: Dict[str, int] = {rule.name: 0 for rule in self.rules}
+        # Shadow-mode comparison against the LLM
+        self.compared = 0
+        self.agreed = 0
+
+    def evaluate(self, text: str, latitude: Optional[float] = None,
+                 longitude: Optional[float] = None) -> Optional[Tuple[str, FraudDetection]]:
+        """Return (rule name, verdict) for a high-confidence case, or None to defer to the LLM."""
+        self.evaluated += 1
+        for rule in self.rules:
+            verdict = rule.evaluate(text, latitude, longitude)
+            if verdict is None:
+                continue
+            # A confident verdict is one far enough from 0.5 in either direction
+            if max(verdict.score, 1.0 - verdict.score) >= self.min_confidence:
+                self.decided += 1
+                self.rule_hits[rule.name] += 1
+                return rule.name, verdict
+        return None
+
+    def record_agreement(self, rule_verdict: FraudDetection, llm_verdict: FraudDetection) -> bool:
+        """Count whether the LLM reached the same fraud flag as a rule (shadow mode)."""
+        agreed = rule_verdict.fraud == llm_verdict.fraud
+        self.compared += 1
+        self.agreed += agreed
+        return agreed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "evaluated": self.evaluated,
+            "decided": self.decided,
+            "rule_hits": dict(self.rule_hits),
+            "compared": self.compared,
+            "agreed": self.agreed,
+            "agreement_rate": self.agreed / self.compared if self.compared else 0.0,
+        }
+
+
+# Shared engine used by fraud_detector
+rule_engine = RuleEngine()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Command-line utility to score a file of fraud detection requests in bulk.
+Input is a JSON array or NDJSON of FraudRequest objects; results are printed as NDJSON.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from typing import Any, Iterator
+
+from config import BATCH_CONCURRENCY
+
+def read_items(path: str) -> Iterator[Any]:
+    """Yield request items from a JSON array file or, line by line, from an NDJSON file."""
+    f = sys.stdin if path == "-" else open(path, "r")
+    with f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        if first == "[":
+            yield from json.loads(first + f.read())
+            return
+        # NDJSON: items are parsed by the scorer so a bad line only fails that item
+        if first:
+            yield first + f.readline()
+        for line in f:
+            if line.strip():
+                yield line
+
+async def score_locally(args) -> int:
+    from batch import score_batch
+    errors = 0
+    async for result in score_batch(read_items(args.input), args.concurrency):
+        errors += "error" in result
+        print(json.dumps(result), flush=True)
+    return errors
+
+async def score_remotely(args) -> int:
+    import aiohttp
+    url = args.url.rstrip("/") + f"/batch?concurrency={args.concurrency}"
+
+    async def body():
+        for item in read_items(args.input):
+            line = item if isinstance(item, str) else json.dumps(item) + "\n"
+            yield line.encode()
+
+    errors = 0
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, data=body(), headers={"Content-Type": "application/x-ndjson"}) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if line.strip():
+                    errors += b'"error"' in line
+                    sys.stdout.write(line.decode())
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Score fraud detection requests in bulk")
+    parser.add_argument("input", help="JSON array or NDJSON file of requests ('-' for stdin)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Maximum concurrent scoring calls")
+    parser.add_argument("--url", help="Send the batch to a running server (e.g. http://localhost:3001) instead of scoring in-process")
+    args = parser.parse_args()
+
+    errors = asyncio.run(score_remotely(args) if args.url else score_locally(args))
+    if errors:
+        print(f"{errors} item(s) failed", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
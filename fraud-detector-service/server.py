@@ -1,38 +1,208 @@
 import asyncio
+import os
+import socket
+from typing import Optional
 from aiohttp import web
-from handlers import handle_fraud_detection, handle_options
+from handlers import handle_fraud_detection, handle_options, handle_job
 from admin import handle_admin
-from config import SERVER_HOST, SERVER_PORT
+from admin_events import admin_events, handle_admin_events
+from health import readiness, readiness_middleware, handle_healthz, handle_readyz
+from analytics import log_summary, handle_admin_summary
+from batch import handle_batch
+from admission import admission, admission_middleware
+from metrics import registry, metrics_middleware, handle_metrics
+from log_writer import log_writer
+from jobs import job_manager
+from verdict_cache import verdict_cache
+from fraud_detector import scoring_flight, start_client, close_client
+from model_router import model_router
+from circuit_breaker import llm_breaker
+from rules import rule_engine
+from user_history import user_history
+from template_index import template_index
+from config import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, VERDICT_CACHE_ENABLED, VERDICT_CACHE_PERSIST, HISTORY_ENABLED,
+    TEMPLATE_MODE,
+)
 
-async def main():
-    """Sets up and starts the aiohttp web server."""
-    app = web.Application()
+async def start_llm_client(app: web.Application) -> None:
+    # Warm up while the other warm-up steps run; the server is ready once it is done
+    readiness.wait_for(asyncio.create_task(start_client()))
+
+async def stop_llm_client(app: web.Application) -> None:
+    await close_client()
+
+async def start_log_writer(app: web.Application) -> None:
+    await log_writer.start()
+
+async def stop_log_writer(app: web.Application) -> None:
+    # Flush queued log entries before the process exits
+    await log_writer.stop()
+
+async def start_job_workers(app: web.Application) -> None:
+    # Also re-queues jobs left unfinished by the previous run
+    await job_manager.start()
+
+async def stop_job_workers(app: web.Application) -> None:
+    await job_manager.stop()
+
+async def close_admin_events(app: web.Application) -> None:
+    # End open SSE streams so shutdown does not wait for them
+    admin_events.close()
+
+async def rebuild_user_history(app: web.Application) -> None:
+    await asyncio.to_thread(user_history.rebuild)
+
+async def rebuild_template_index(app: web.Application) -> None:
+    await asyncio.to_thread(template_index.rebuild)
+
+async def load_log_summary(app: web.Application) -> None:
+    # Saved summary plus whatever was logged after it was saved
+    await asyncio.to_thread(log_summary.catch_up)
+
+async def save_log_summary(app: web.Application) -> None:
+    # Not if shutdown interrupted loading it
+    if readiness.finished(load_log_summary):
+        await asyncio.to_thread(log_summary.save)
+
+async def load_verdict_cache(app: web.Application) -> None:
+    # Start warm with verdicts cached before the last shutdown
+    if VERDICT_CACHE_ENABLED and VERDICT_CACHE_PERSIST:
+        await asyncio.to_thread(verdict_cache.load)
+
+async def save_verdict_cache(app: web.Application) -> None:
+    # A cache whose loading was interrupted would overwrite the saved one
+    if VERDICT_CACHE_ENABLED and VERDICT_CACHE_PERSIST and readiness.finished(load_verdict_cache):
+        await asyncio.to_thread(verdict_cache.save)
+
+def create_app() -> web.Application:
+    """Builds the aiohttp application with all routes and lifecycle hooks."""
+    readiness.starting()
+    # Metrics wrap everything so rejected requests are counted too. Requests other than
+    # the probes get a 503 until the warm-up is done; admission control then rate-limits
+    # and sheds load before a request reaches the handler
+    app = web.Application(middlewares=[metrics_middleware, readiness_middleware, admission_middleware])
 
     # Register routes
     app.router.add_post('/', handle_fraud_detection)
     app.router.add_route('OPTIONS', '/', handle_options) # Handle CORS preflight
+    app.router.add_post('/batch', handle_batch)  # Bulk scoring, streams NDJSON results
+    app.router.add_route('OPTIONS', '/batch', handle_options)
+    app.router.add_get('/jobs/{job_id}', handle_job)  # Async scoring results
     app.router.add_get('/admin', handle_admin)  # Admin UI
+    app.router.add_get('/admin/events', handle_admin_events)  # Live admin rows (SSE)
+    app.router.add_get('/admin/summary', handle_admin_summary)  # Request log analytics (JSON)
+    app.router.add_get('/metrics', handle_metrics)  # Prometheus metrics
+    app.router.add_get('/healthz', handle_healthz)  # Liveness probe
+    app.router.add_get('/readyz', handle_readyz)  # Readiness probe
+
+    # Components that keep their own counters
+    registry.register_stats("log_writer", log_writer.stats)
+    registry.register_stats("verdict_cache", verdict_cache.stats)
+    registry.register_stats("singleflight", scoring_flight.stats)
+    registry.register_stats("prescreen", rule_engine.stats)
+    registry.register_stats("admission", admission.stats)
+    registry.register_stats("router", model_router.stats)
+    registry.register_stats("circuit", llm_breaker.stats)
+    registry.register_stats("jobs", job_manager.stats)
+    registry.register_stats("admin_events", admin_events.stats)
+    registry.register_stats("history", user_history.stats)
+    registry.register_stats("templates", template_index.stats)
+    registry.register_stats("summary", log_summary.stats)
+    registry.register_stats("health", readiness.stats)
+
+    # Slow startup work is added as warm-up steps rather than on_startup hooks. They run
+    # in order once the port is open, so /healthz and /readyz answer meanwhile (see health.py)
+    app.on_shutdown.insert(0, readiness.stop)
+
+    # Shared LLM client (one connection pool), warmed up alongside the other steps
+    readiness.add_step(start_llm_client)
+
+    # Push every newly written entry to open admin pages
+    log_writer.add_listener(admin_events.publish)
+    app.on_shutdown.append(close_admin_events)
+
+    # Per-user history for scoring, loaded before any request can be served
+    if HISTORY_ENABLED:
+        log_writer.add_listener(user_history.record_entries)
+        readiness.add_step(rebuild_user_history)
+
+    # Near-duplicate clusters of request texts
+    if TEMPLATE_MODE != "off":
+        log_writer.add_listener(template_index.record_entries)
+        readiness.add_step(rebuild_template_index)
+
+    # Analytics summary, updated with every written entry
+    log_writer.add_listener(log_summary.add_entries)
+    readiness.add_step(load_log_summary)
+    app.on_cleanup.append(save_log_summary)
+
+    # Background persistence of the request log, started after the rebuilds so its
+    # listeners only see entries newer than what the rebuilds read
+    readiness.add_step(start_log_writer)
+    app.on_cleanup.append(stop_log_writer)
+
+    # Async scoring workers, started after the log writer and stopped before it
+    readiness.add_step(start_job_workers)
+    app.on_cleanup.insert(0, stop_job_workers)
+
+    # Persistent verdict cache
+    readiness.add_step(load_verdict_cache)
+    app.on_cleanup.append(save_verdict_cache)
+
+    # The only startup hook: it starts the warm-up steps in the background. The LLM
+    # client is closed after the job workers and the log writer have stopped
+    app.on_startup.append(readiness.start)
+    app.on_cleanup.append(stop_llm_client)
+
+    return app
+
+async def main(host: str = SERVER_HOST, port: int = SERVER_PORT, sock: Optional[socket.socket] = None,
+               reuse_port: bool = False, stop: Optional[asyncio.Event] = None):
+    """Sets up and starts the aiohttp web server.
+
+    Worker processes (see workers.py) pass the listening socket they inherited, or
+    reuse_port to bind their own, and an event that is set on SIGTERM.
+    """
+    app = create_app()
 
     # Setup application runner
     runner = web.AppRunner(app)
     await runner.setup()
 
     # Create TCP site server
-    site = web.TCPSite(runner, SERVER_HOST, SERVER_PORT)
+    if sock is not None:
+        site = web.SockSite(runner, sock)
+    else:
+        site = web.TCPSite(runner, host, port, reuse_port=reuse_port or None)
+
+    if sock is not None or reuse_port:
+        # Pre-fork worker: the other workers serve the port meanwhile, so a (re)starting
+        # worker only takes connections once warmed up instead of answering them with 503
+        await readiness.wait()
 
     # Start the server
-    print(f"Starting server on http://{SERVER_HOST}:{SERVER_PORT}...")
+    print(f"Starting server on http://{host}:{port} (pid {os.getpid()})...")
     await site.start()
 
     # Keep the server running until interrupted
     # Use asyncio.Event().wait() for indefinite running
     # Or use await asyncio.sleep(3600*24) # Example: Run for 1 day
-    await asyncio.Event().wait()
+    try:
+        await (stop or asyncio.Event()).wait()
+    finally:
+        # Stops accepting connections, lets in-flight requests finish and
+        # runs the on_cleanup hooks, which drain the log writer
+        await runner.cleanup()
 
 if __name__ == "__main__":
-    try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        print("\nServer stopped gracefully.")
-    except Exception as e:
-        print(f"\nAn error occurred during server startup or runtime: {e}")
+    if SERVER_WORKERS > 1:
+        from workers import run_workers
+        run_workers(SERVER_WORKERS)
+    else:
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            print("\nServer stopped gracefully.")
+        except Exception as e:
+            print(f"\nAn error occurred during server startup or runtime: {e}")
@@ -0,0 +1,68 @@
+"""
+Request coalescing: concurrent callers with the same key share one in-flight call.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and hands its result to every waiting caller."""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn() for key, or join the call already in flight for it.
+
+        Exceptions from fn() are raised in every caller. A caller that is cancelled
+        only stops waiting; the shared call is cancelled once no callers are left.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._finish(key, call))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            # shield() keeps one caller's cancellation from cancelling the shared task
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody is waiting for the result any more; later callers start afresh
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+                self.cancelled += 1
+
+    def _finish(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            # Mark the exception as retrieved; the waiters have already received it
+            call.task.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+        }
@@ -0,0 +1,138 @@
+"""
+SQLite backend for the request log.
+Entries are stored as JSON alongside indexed columns used by the admin UI and CLI queries.
+"""
+import datetime
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Any, Iterator
+
+from storage import StorageBackend, encode_entry
+from config import LOG_RETENTION_DAYS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    user_id TEXT NOT NULL DEFAULT '',
+    score REAL,
+    fraud INTEGER,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_requests_timestamp ON requests (timestamp);
+CREATE INDEX IF NOT EXISTS idx_requests_user ON requests (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_requests_score ON requests (score);
+CREATE INDEX IF NOT EXISTS idx_requests_fraud ON requests (fraud, id);
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    """Request log stored in a SQLite database in WAL mode."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        # sqlite3 connections are per thread; writes run in executor threads
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._write_lock:
+            self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            # WAL lets readers (admin page, CLI) run while the writer appends
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_values(entry: Dict[str, Any]):
+        request = entry.get("request") or {}
+        response = entry.get("response") or {}
+        return (
+            entry.get("timestamp", ""),
+            request.get("user_id", "") or "",
+            response.get("score"),
+            response.get("fraud"),
+            encode_entry(entry, exclude=("id",)).decode(),
+        )
+
+    def append(self, entries: List[Dict[str, Any]]) -> None:
+        """Insert a batch of entries in a single transaction."""
+        with self._write_lock:
+            conn = self._connection()
+            with conn:
+                for entry in entries:
+                    cursor = conn.execute(
+                        "INSERT INTO requests (timestamp, user_id, score, fraud, entry) VALUES (?, ?, ?, ?, ?)",
+                        self._row_values(entry),
+                    )
+                    entry["id"] = cursor.lastrowid
+
+    def query(self, newest_first=False, limit=None, since=None, until=None,
+              user_id=None, min_score=None, max_score=None, fraud=None,
+              before_id=None, after_id=None, include_pending=False) -> Iterator[Dict[str, Any]]:
+        clauses = []
+        params: List[Any] = []
+        if not include_pending:
+            # Pending async jobs are stored without a score
+            clauses.append("score IS NOT NULL")
+        if before_id is not None:
+            clauses.append("id < ?")
+            params.append(before_id)
+        if after_id is not None:
+            clauses.append("id > ?")
+            params.append(after_id)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if min_score is not None:
+            clauses.append("score >= ?")
+            params.append(min_score)
+        if max_score is not None:
+            clauses.append("score < ?")
+            params.append(max_score)
+        if fraud is not None:
+            clauses.append("fraud = ?")
+            params.append(fraud)
+
+        sql = "SELECT id, entry FROM requests"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id DESC" if newest_first else " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        for row_id, body in self._connection().execute(sql, params):
+            entry = json.loads(body)
+            entry["id"] = row_id
+            yield entry
+
+    def count(self) -> int:
+        # Entries without a response (older async job records) are not requests
+        return self._connection().execute("SELECT COUNT(*) FROM requests WHERE score IS NOT NULL").fetchone()[0]
+
+    def last_id(self) -> int:
+        return self._connection().execute("SELECT COALESCE(MAX(id), 0) FROM requests").fetchone()[0]
+
+    def maintain(self) -> Dict[str, int]:
+        """Delete rows older than LOG_RETENTION_DAYS (the database has no segments to archive)."""
+        if not LOG_RETENTION_DAYS:
+            return {"deleted": 0}
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=LOG_RETENTION_DAYS)).isoformat()
+        with self._write_lock:
+            conn = self._connection()
+            with conn:
+                deleted = conn.execute("DELETE FROM requests WHERE timestamp < ?", (cutoff,)).rowcount
+        return {"deleted": deleted}
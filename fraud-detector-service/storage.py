@@ -1,59 +1,695 @@
 import json
 import os
 import datetime
+import gzip
+import time
 from pathlib import Path
-import asyncio
-from typing import Dict, List, Any
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; only single-process use is safe there
+    fcntl = None
+
+from config import (
+    DATA_DIR as DATA_DIR_SETTING, LOG_SEGMENT_MAX_BYTES, LOG_SEGMENT_MAX_AGE, LOG_FSYNC, STORAGE_BACKEND,
+    LOG_ARCHIVE_COMPRESS_LEVEL, LOG_RETENTION_DAYS, LOG_ARCHIVE_MAX_BYTES, LOG_ARCHIVE_CACHE_SIZE,
+    LOG_TIMESTAMP_SKEW,
+)
 
 # Constants
-DATA_DIR = Path(__file__).parent / "data"
+DATA_DIR = Path(DATA_DIR_SETTING)
+LOG_DIR = DATA_DIR / "log"
+SEGMENT_PREFIX = "requests-"
+SEGMENT_SUFFIX = ".ndjson"
+# Closed segments are compressed into ARCHIVE_DIR and listed in its manifest
+ARCHIVE_DIR = LOG_DIR / "archive"
+ARCHIVE_SUFFIX = ".ndjson.gz"
+MANIFEST_FILE = "manifest.json"
+# Legacy single-array log, migrated into segments on first use
 REQUESTS_FILE = DATA_DIR / "requests.json"
+SQLITE_FILE = DATA_DIR / "requests.db"
+# flock()ed around appends so several server processes can share the log
+LOCK_FILE = LOG_DIR / ".lock"
+# Log entry key holding fields the handler already serialized (see make_raw_log_entry)
+RAW_KEY = "_raw"
+
+# Create data directories if they don't exist
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+LOG_DIR.mkdir(exist_ok=True)
+
+# Lock to prevent concurrent appends; appends run in worker threads
+file_lock = threading.Lock()
+_lock_file = None
+_lock_file_pid = None
+
+
+@contextmanager
+def log_lock() -> Iterator[None]:
+    """Exclusive lock on the log across threads and processes."""
+    global _lock_file, _lock_file_pid
+    with file_lock:
+        if fcntl is None:
+            yield
+            return
+        if _lock_file_pid != os.getpid():
+            # A descriptor inherited through fork() shares its lock with the parent,
+            # so each process opens its own
+            _lock_file = open(LOCK_FILE, "a")
+            _lock_file_pid = os.getpid()
+        fcntl.flock(_lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(_lock_file, fcntl.LOCK_UN)
+
+
+class StorageBackend:
+    """Interface implemented by request log backends. All methods are synchronous."""
+
+    def append(self, entries: List[Dict[str, Any]]) -> None:
+        """Persist entries in order, setting each entry's "id"."""
+        raise NotImplementedError
+
+    def query(self, newest_first: bool = False, limit: Optional[int] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              user_id: Optional[str] = None, min_score: Optional[float] = None,
+              max_score: Optional[float] = None, fraud: Optional[int] = None,
+              before_id: Optional[int] = None, after_id: Optional[int] = None,
+              include_pending: bool = False) -> Iterator[Dict[str, Any]]:
+        """Stream entries matching the filters.
 
-# Create data directory if it doesn't exist
-DATA_DIR.mkdir(exist_ok=True)
+        since/until are ISO timestamps (until is exclusive). before_id/after_id are
+        exclusive id cursors used for pagination. Entries without a response (async job
+        records written by older versions, see jobs.py) are skipped unless include_pending
+        is set; they never match the score and fraud filters.
+        """
+        raise NotImplementedError
 
-# File lock to prevent concurrent writes
-file_lock = asyncio.Lock()
+    def count(self) -> int:
+        raise NotImplementedError
 
-async def load_requests() -> List[Dict[str, Any]]:
-    """Load existing requests from the JSON file."""
+    def last_id(self) -> int:
+        """Id of the newest stored entry, or 0 if there is none."""
+        raise NotImplementedError
+
+    def maintain(self) -> Dict[str, int]:
+        """Periodic housekeeping (archiving, retention). Returns counts of what was done."""
+        return {}
+
+
+def shift_timestamp(timestamp: Optional[str], seconds: float) -> Optional[str]:
+    """An ISO timestamp moved by seconds; None if it is None or not a valid timestamp."""
+    if timestamp is None:
+        return None
     try:
-        if REQUESTS_FILE.exists():
-            async with file_lock:
-                with open(REQUESTS_FILE, "r") as f:
-                    return json.load(f)
-        return []
-    except json.JSONDecodeError:
-        # If the file is corrupted, return an empty list
-        return []
-
-def get_requests_sync() -> List[Dict[str, Any]]:
-    """Synchronous version of load_requests for command-line tools."""
+        return (datetime.datetime.fromisoformat(timestamp) + datetime.timedelta(seconds=seconds)).isoformat()
+    except ValueError:
+        return None
+
+
+def archive_time_range(archive: Dict[str, Any]) -> Tuple[str, str]:
+    """Earliest and latest timestamp in an archive (manifests written before they were kept
+    list the first and last entry's instead)."""
+    return (archive.get("min_timestamp", archive.get("first_timestamp", "")),
+            archive.get("max_timestamp", archive.get("last_timestamp", "")))
+
+
+def entry_matches(entry: Dict[str, Any], since: Optional[str] = None, until: Optional[str] = None,
+                  user_id: Optional[str] = None, min_score: Optional[float] = None,
+                  max_score: Optional[float] = None, fraud: Optional[int] = None) -> bool:
+    """Apply query filters to a single entry in Python."""
+    try:
+        timestamp = entry["timestamp"]
+        if since is not None and timestamp < since:
+            return False
+        if until is not None and timestamp >= until:
+            return False
+        if user_id is not None and entry["request"].get("user_id", "") != user_id:
+            return False
+        if entry["response"] is None:
+            # Pending async job: it has no score yet
+            return min_score is None and max_score is None and fraud is None
+        score = entry["response"]["score"]
+        if min_score is not None and score < min_score:
+            return False
+        if max_score is not None and score >= max_score:
+            return False
+        if fraud is not None and entry["response"]["fraud"] != fraud:
+            return False
+    except (KeyError, TypeError):
+        return False
+    return True
+
+
+class SegmentedLogBackend(StorageBackend):
+    """
+    Append-only log of newline-delimited JSON segments, rolled over by size and age.
+    Closed segments are compressed into archives by maintain(); queries read archives
+    lazily, skipping those outside their time range or id cursor.
+    """
+
+    def __init__(self, log_dir: Path = LOG_DIR, legacy_file: Path = REQUESTS_FILE):
+        self.log_dir = log_dir
+        self.archive_dir = log_dir / ARCHIVE_DIR.name
+        self.legacy_file = legacy_file
+        # Append state, recovered from the newest segment on first use
+        self._next_id: Optional[int] = None
+        self._active_segment: Optional[Path] = None
+        self._active_size = 0
+        # Wall-clock time the active segment was started, for LOG_SEGMENT_MAX_AGE
+        self._active_started: Optional[float] = None
+        # Manifest as last read, with the (mtime, size) it was read at
+        self._manifest: Optional[Tuple[Tuple[int, int], List[Dict[str, Any]]]] = None
+        # (newest segment, its size) as of our last append, to notice other writers
+        self._tail: Optional[Tuple[Path, int]] = None
+        # Archive file name -> its lines, most recently read last (LOG_ARCHIVE_CACHE_SIZE)
+        self._archive_lines: "OrderedDict[str, List[bytes]]" = OrderedDict()
+        self._archive_lines_lock = threading.Lock()
+
+    def _segment_path(self, first_id: int) -> Path:
+        """Segments are named after the id of their first entry so they sort in log order."""
+        return self.log_dir / f"{SEGMENT_PREFIX}{first_id:012d}{SEGMENT_SUFFIX}"
+
+    def _list_segments(self) -> List[Path]:
+        """Return all log segments, oldest first."""
+        return sorted(self.log_dir.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))
+
+    @staticmethod
+    def _segment_first_id(segment: Path) -> int:
+        return int(segment.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    @staticmethod
+    def _read_first_entry(segment: Path) -> Optional[Dict[str, Any]]:
+        with open(segment, "rb") as f:
+            try:
+                return json.loads(f.readline())
+            except json.JSONDecodeError:
+                return None
+
+    @classmethod
+    def _read_last_entry(cls, segment: Path, block_size: int = 64 * 1024) -> Optional[Dict[str, Any]]:
+        """Return the last complete entry in a segment, truncating a torn final write."""
+        with open(segment, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            position = size
+            end = 0
+            while position > 0:
+                read_size = min(block_size, position)
+                position -= read_size
+                f.seek(position)
+                newline = f.read(read_size).rfind(b"\n")
+                if newline != -1:
+                    end = position + newline + 1
+                    break
+            if end != size:
+                # A writer died mid-append; drop the partial line
+                f.truncate(end)
+        return next(cls._iter_segment_reversed(segment), None)
+
+    def _migrate_legacy_file(self) -> None:
+        """One-time import of the old pretty-printed JSON array into the segmented log."""
+        if not self.legacy_file.exists() or self._list_segments() or self._archives():
+            return
+        try:
+            with open(self.legacy_file, "r") as f:
+                legacy = json.load(f)
+        except json.JSONDecodeError:
+            legacy = []
+        if legacy:
+            self._append_locked(legacy)
+        self.legacy_file.rename(self.legacy_file.with_name(self.legacy_file.name + ".migrated"))
+
+    def _ensure_log(self) -> None:
+        """Recover the next id and the active segment (and migrate legacy data) once per process."""
+        if self._next_id is not None:
+            return
+        self._next_id = 1
+        self._migrate_legacy_file()
+        self._recover_tail()
+
+    def _recover_tail(self) -> None:
+        """Take the next id and active segment from the newest segment on disk."""
+        segments = self._list_segments()
+        if not segments:
+            archives = self._archives()
+            if archives:
+                # Everything was archived (only happens if the live segments were removed)
+                self._next_id = archives[-1]["last_id"] + 1
+            return
+        newest = segments[-1]
+        last = self._read_last_entry(newest)
+        self._next_id = last["id"] + 1 if last is not None else self._segment_first_id(newest)
+        self._active_size = newest.stat().st_size
+        self._tail = (newest, self._active_size)
+        # A full segment is left alone; the next append starts a new one
+        self._active_segment = newest if self._active_size < LOG_SEGMENT_MAX_BYTES else None
+        first = self._read_first_entry(newest) if self._active_segment is not None else None
+        self._active_started = parse_timestamp(first.get("timestamp")) if first else None
+
+    def _sync_tail(self) -> None:
+        """Catch up with entries appended by other processes since our last append."""
+        segments = self._list_segments()
+        if not segments:
+            return
+        newest = segments[-1]
+        if (newest, newest.stat().st_size) != self._tail:
+            self._recover_tail()
+
+    def _append_locked(self, entries: List[Dict[str, Any]]) -> None:
+        """Assign ids to entries and append them with one write and fsync per segment touched."""
+        pending: List[bytes] = []
+        pending_size = 0
+        for entry in entries:
+            if (self._active_segment is not None and not pending and self._active_started is not None
+                    and time.time() - self._active_started >= LOG_SEGMENT_MAX_AGE):
+                # Roll over by age
+                self._active_segment = None
+            if self._active_segment is None:
+                self._active_segment = self._segment_path(self._next_id)
+                self._active_size = 0
+                self._active_started = time.time()
+            entry["id"] = self._next_id
+            self._next_id += 1
+            line = encode_entry(entry) + b"\n"
+            pending.append(line)
+            pending_size += len(line)
+            if self._active_size + pending_size >= LOG_SEGMENT_MAX_BYTES:
+                self._write_lines(self._active_segment, pending)
+                pending, pending_size = [], 0
+                # Roll over; the next entry starts a fresh segment
+                self._active_segment = None
+        if pending:
+            self._write_lines(self._active_segment, pending)
+            self._active_size += pending_size
+
+    def _write_lines(self, segment: Path, lines: List[bytes]) -> None:
+        with open(segment, "ab") as f:
+            f.write(b"".join(lines))
+            if LOG_FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+            self._tail = (segment, f.tell())
+
+    def append(self, entries: List[Dict[str, Any]]) -> None:
+        with log_lock():
+            self._ensure_log()
+            self._sync_tail()
+            self._append_locked(entries)
+
+    @staticmethod
+    def _iter_segment(segment: Path) -> Iterator[Dict[str, Any]]:
+        # Bytes: lines are UTF-8 whatever the locale (non-ASCII text is not escaped)
+        with open(segment, "rb") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Skip a torn or corrupted line rather than losing the segment
+                    continue
+
+    @staticmethod
+    def _iter_segment_reversed(segment: Path, block_size: int = 64 * 1024) -> Iterator[Dict[str, Any]]:
+        """Read a segment backwards in blocks so newest-first pages only decode what they show."""
+        with open(segment, "rb") as f:
+            position = f.seek(0, os.SEEK_END)
+            tail = b""
+            while position > 0:
+                read_size = min(block_size, position)
+                position -= read_size
+                f.seek(position)
+                lines = (f.read(read_size) + tail).split(b"\n")
+                # The first piece may be the end of a line that starts in an earlier block
+                tail = lines.pop(0)
+                for line in reversed(lines):
+                    if line:
+                        try:
+                            yield json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+            if tail:
+                try:
+                    yield json.loads(tail)
+                except json.JSONDecodeError:
+                    pass
+
+    def _iter_all(self, newest_first: bool, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                  since: Optional[str] = None, until: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        with log_lock():
+            self._ensure_log()
+        segments = self._list_segments()
+        # Listed after the segments: a segment archived in between shows up in both
+        archives = self._archives()
+        archived = {archive["first_id"] for archive in archives}
+        # (first id, live segment or archive manifest entry), in log order
+        parts: List[Tuple[int, Any]] = sorted(
+            [(archive["first_id"], archive) for archive in archives]
+            + [(self._segment_first_id(s), s) for s in segments if self._segment_first_id(s) not in archived],
+            key=lambda part: part[0])
+        # Segment names carry their first id, so cursors skip whole segments unread
+        if before_id is not None:
+            parts = [part for part in parts if part[0] < before_id]
+        if after_id is not None:
+            parts = [part for i, part in enumerate(parts)
+                     if i + 1 == len(parts) or parts[i + 1][0] > after_id + 1]
+        # Archives also know their time range, so queries for recent entries never open them
+        parts = [(first_id, part) for first_id, part in parts
+                 if isinstance(part, Path)
+                 or ((since is None or archive_time_range(part)[1] >= since)
+                     and (until is None or archive_time_range(part)[0] < until))]
+        if not newest_first:
+            for _, part in parts:
+                yield from self._iter_part(part, reverse=False)
+            return
+        for _, part in reversed(parts):
+            yield from self._iter_part(part, reverse=True)
+
+    def _iter_part(self, part: Any, reverse: bool) -> Iterator[Dict[str, Any]]:
+        if isinstance(part, Path):
+            try:
+                if reverse:
+                    yield from self._iter_segment_reversed(part)
+                else:
+                    yield from self._iter_segment(part)
+                return
+            except FileNotFoundError:
+                # Archived since it was listed
+                part = {"file": part.name.replace(SEGMENT_SUFFIX, ARCHIVE_SUFFIX)}
+        if reverse:
+            lines = reversed(self._read_archive(part["file"]))
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+            return
+        with gzip.open(self.archive_dir / part["file"], "rb") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def _read_archive(self, name: str) -> List[bytes]:
+        """All lines of an archive, from the cache of recently read ones if possible."""
+        with self._archive_lines_lock:
+            lines = self._archive_lines.get(name)
+            if lines is not None:
+                self._archive_lines.move_to_end(name)
+                return lines
+        # Archives never change once written, so a cached copy is never stale
+        with gzip.open(self.archive_dir / name, "rb") as f:
+            lines = f.readlines()
+        with self._archive_lines_lock:
+            self._archive_lines[name] = lines
+            while len(self._archive_lines) > LOG_ARCHIVE_CACHE_SIZE:
+                self._archive_lines.popitem(last=False)
+        return lines
+
+    def query(self, newest_first=False, limit=None, since=None, until=None,
+              user_id=None, min_score=None, max_score=None, fraud=None,
+              before_id=None, after_id=None, include_pending=False):
+        returned = 0
+        # The log is roughly in time order; stop once well past the requested range
+        stop_before = shift_timestamp(since, -LOG_TIMESTAMP_SKEW) if newest_first else None
+        stop_after = shift_timestamp(until, LOG_TIMESTAMP_SKEW) if not newest_first else None
+        for entry in self._iter_all(newest_first, before_id, after_id, since, until):
+            if limit is not None and returned >= limit:
+                return
+            entry_id = entry.get("id", 0)
+            if before_id is not None and entry_id >= before_id:
+                continue
+            if after_id is not None and entry_id <= after_id:
+                if newest_first:
+                    return
+                continue
+            timestamp = entry.get("timestamp", "")
+            if stop_before is not None and timestamp < stop_before:
+                return
+            if stop_after is not None and timestamp >= stop_after:
+                return
+            if entry.get("response") is None and not include_pending:
+                continue
+            if entry_matches(entry, since, until, user_id, min_score, max_score, fraud):
+                returned += 1
+                yield entry
+
+    def last_id(self) -> int:
+        # Tracked by the appender; only re-read when another process has appended
+        with log_lock():
+            self._ensure_log()
+            self._sync_tail()
+            return self._next_id - 1
+
+    def count(self) -> int:
+        """
+        Count stored requests by counting lines, without decoding any JSON. Archived
+        segments are counted when archived, leaving out entries without a response.
+        """
+        with log_lock():
+            self._ensure_log()
+        segments = self._list_segments()
+        archives = self._archives()
+        archived = {archive["first_id"] for archive in archives}
+        total = sum(archive["entries"] for archive in archives)
+        for segment in segments:
+            if self._segment_first_id(segment) in archived:
+                continue
+            try:
+                with open(segment, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        total += chunk.count(b"\n")
+            except FileNotFoundError:
+                # Archived meanwhile; not in the manifest we read
+                continue
+        return total
+
+    def _archives(self) -> List[Dict[str, Any]]:
+        """Manifest entries of the archived segments, oldest first (re-read when it changes)."""
+        path = self.archive_dir / MANIFEST_FILE
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return []
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if self._manifest is None or self._manifest[0] != stamp:
+            with open(path, "r") as f:
+                self._manifest = (stamp, json.load(f)["archives"])
+        return self._manifest[1]
+
+    def _write_manifest(self, archives: List[Dict[str, Any]]) -> None:
+        path = self.archive_dir / MANIFEST_FILE
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"archives": sorted(archives, key=lambda archive: archive["first_id"])}, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def archive_segment(self, segment: Path) -> bool:
+        """
+        Compress a closed segment into the archive and remove it from the live log.
+        Compression runs outside the log lock; only the manifest update holds it.
+        """
+        name = segment.name.replace(SEGMENT_SUFFIX, ARCHIVE_SUFFIX)
+        tmp_path = self.archive_dir / (name + f".{os.getpid()}.tmp")
+        first = last = None
+        # Not the first and last entries' timestamps: the log is only roughly in time order
+        min_timestamp = max_timestamp = None
+        entries = 0
+        with open(segment, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=LOG_ARCHIVE_COMPRESS_LEVEL) as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                dst.write(line)
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get("response") is not None:
+                    entries += 1
+                if first is None:
+                    first = entry
+                last = entry
+                timestamp = entry.get("timestamp")
+                if timestamp:
+                    min_timestamp = timestamp if min_timestamp is None else min(min_timestamp, timestamp)
+                    max_timestamp = timestamp if max_timestamp is None else max(max_timestamp, timestamp)
+        if first is None:
+            tmp_path.unlink()
+            # Nothing but blank lines; drop it unless it has become the active segment
+            with log_lock():
+                segments = self._list_segments()
+                if segment.exists() and segment != segments[-1]:
+                    segment.unlink()
+            return False
+
+        with log_lock():
+            self._manifest = None
+            archives = [archive for archive in self._archives() if archive["first_id"] != first["id"]]
+            if not segment.exists():
+                # Another process archived it first
+                tmp_path.unlink()
+                return False
+            os.replace(tmp_path, self.archive_dir / name)
+            archives.append({
+                "file": name,
+                "first_id": first["id"],
+                "last_id": last["id"],
+                "min_timestamp": min_timestamp or "",
+                "max_timestamp": max_timestamp or "",
+                "entries": entries,
+                "bytes": (self.archive_dir / name).stat().st_size,
+                "raw_bytes": segment.stat().st_size,
+            })
+            self._write_manifest(archives)
+            segment.unlink()
+        return True
+
+    def apply_retention(self, retention_days: float = LOG_RETENTION_DAYS,
+                        max_bytes: int = LOG_ARCHIVE_MAX_BYTES) -> int:
+        """Delete archives past the retention limits. Returns how many were deleted."""
+        if not retention_days and not max_bytes:
+            return 0
+        with log_lock():
+            self._manifest = None
+            archives = list(self._archives())
+            keep = archives
+            if retention_days:
+                cutoff = (datetime.datetime.now() - datetime.timedelta(days=retention_days)).isoformat()
+                keep = [archive for archive in keep if archive_time_range(archive)[1] >= cutoff]
+            if max_bytes:
+                total = sum(archive["bytes"] for archive in keep)
+                while keep and total > max_bytes:
+                    total -= keep.pop(0)["bytes"]
+            deleted = [archive for archive in archives if archive not in keep]
+            if not deleted:
+                return 0
+            # Manifest first: a crash in between leaves orphan files, not missing ones
+            self._write_manifest(keep)
+            for archive in deleted:
+                try:
+                    (self.archive_dir / archive["file"]).unlink()
+                except FileNotFoundError:
+                    pass
+        return len(deleted)
+
+    def maintain(self) -> Dict[str, int]:
+        """Archive every closed segment (all but the newest), then apply retention."""
+        with log_lock():
+            self._ensure_log()
+        self.archive_dir.mkdir(exist_ok=True)
+        archived = 0
+        for segment in self._list_segments()[:-1]:
+            try:
+                archived += self.archive_segment(segment)
+            except FileNotFoundError:
+                # Archived by another process meanwhile
+                continue
+        return {"archived": archived, "deleted": self.apply_retention()}
+
+
+_backend: Optional[StorageBackend] = None
+
+
+def create_backend(name: str = STORAGE_BACKEND) -> StorageBackend:
+    """Instantiate a storage backend by its config name."""
+    if name == "sqlite":
+        from sqlite_storage import SQLiteBackend
+        return SQLiteBackend(SQLITE_FILE)
+    if name == "log":
+        return SegmentedLogBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+def get_backend() -> StorageBackend:
+    """Return the process-wide storage backend selected by config.STORAGE_BACKEND."""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+
+def append_entries(entries: List[Dict[str, Any]]) -> None:
+    """Append log entries to the request log (synchronous, safe to call from threads)."""
+    for entry in entries:
+        raw = entry.get(RAW_KEY)
+        if raw:
+            # Listeners get dicts; decoding them here keeps it off the request path
+            for key, value in raw.items():
+                entry[key] = json.loads(value)
+    get_backend().append(entries)
+
+
+def query_requests(**filters: Any) -> Iterator[Dict[str, Any]]:
+    """Stream stored requests matching the filters accepted by StorageBackend.query."""
+    return get_backend().query(**filters)
+
+
+def iter_requests(newest_first: bool = False) -> Iterator[Dict[str, Any]]:
+    """Stream stored requests one at a time without loading the whole log."""
+    return get_backend().query(newest_first=newest_first)
+
+
+def last_requests(n: int, **filters: Any) -> List[Dict[str, Any]]:
+    """Return the last n stored requests matching the filters, oldest first."""
+    return list(get_backend().query(newest_first=True, limit=n, **filters))[::-1]
+
+
+def count_requests() -> int:
+    """Count stored requests."""
+    return get_backend().count()
+
+
+def maintain_log() -> Dict[str, int]:
+    """Archive closed log segments and apply retention (blocking; run it in a thread)."""
+    return get_backend().maintain()
+
+
+def last_entry_id() -> int:
+    """High-water mark of the log: changes whenever an entry is appended."""
+    return get_backend().last_id()
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """Epoch seconds of a log entry's ISO timestamp, or None if it is missing or invalid."""
     try:
-        if REQUESTS_FILE.exists():
-            with open(REQUESTS_FILE, "r") as f:
-                return json.load(f)
-        return []
-    except json.JSONDecodeError:
-        # If the file is corrupted, return an empty list
-        return []
-
-async def save_request(request_data: Dict[str, Any], response_data: Dict[str, Any]) -> None:
-    """Save a request and its response to the JSON file."""
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def make_log_entry(request_data: Dict[str, Any], response_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a log entry for a request and its response."""
     # Add timestamp to the log entry
-    log_entry = {
+    return {
         "timestamp": datetime.datetime.now().isoformat(),
         "request": request_data,
         "response": response_data
     }
-    
-    # Load existing requests
-    requests = await load_requests()
-    
-    # Add new request
-    requests.append(log_entry)
-    
-    # Save back to file
-    async with file_lock:
-        with open(REQUESTS_FILE, "w") as f:
-            json.dump(requests, f, indent=2)
\ No newline at end of file
+
+def make_raw_log_entry(request_json: bytes, response_json: bytes) -> Dict[str, Any]:
+    """
+    Log entry for a request and response that are already serialized, e.g. the bytes sent
+    to the client. append_entries decodes the dicts and the JSON is written as is.
+    """
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        RAW_KEY: {"request": request_json, "response": response_json}
+    }
+
+def encode_entry(entry: Dict[str, Any], exclude: Tuple[str, ...] = ()) -> bytes:
+    """
+    JSON for a log entry, without the exclude keys. Pre-serialized fields (see
+    make_raw_log_entry) are spliced in as is, and the raw copy is dropped from the entry.
+    """
+    raw = entry.pop(RAW_KEY, None) or {}
+    fields = {key: value for key, value in entry.items() if key not in raw and key not in exclude}
+    data = json.dumps(fields).encode()
+    spliced = [b"%s: %s" % (json.dumps(key).encode(), value) for key, value in raw.items() if key not in exclude]
+    if not spliced:
+        return data
+    return data[:-1] + (b", " if fields else b"") + b", ".join(spliced) + b"}"
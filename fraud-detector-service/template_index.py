@@ -0,0 +1,261 @@
+"""
+Near-duplicate detection for mass-submitted messages.
+
+Fraud rings send many lightly edited copies of one template. Each stored request
+text is reduced to a MinHash signature of its word shingles and grouped into
+clusters of near-identical texts, found through locality-sensitive hashing (LSH)
+buckets. A new request similar enough to a cluster whose LLM verdicts agree can be
+answered with that verdict (see TEMPLATE_MODE).
+
+Like user_history.py, the index is a log writer listener and is rebuilt from the
+newest part of the request log on startup.
+"""
+import hashlib
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import query_requests
+from config import (
+    TEMPLATE_NUM_HASHES, TEMPLATE_BANDS, TEMPLATE_SHINGLE_SIZE, TEMPLATE_MIN_WORDS, TEMPLATE_SIMILARITY,
+    TEMPLATE_MIN_VERDICTS, TEMPLATE_MIN_AGREEMENT, TEMPLATE_MAX_CLUSTERS, TEMPLATE_REBUILD_MAX_ENTRIES,
+)
+
+WORD_RE = re.compile(r"[a-z']+|[0-9]+")
+# Signatures of recently matched texts, reused when the same request is recorded
+SIGNATURE_CACHE_SIZE = 1024
+
+Signature = Tuple[int, ...]
+
+
+def make_hash_masks(count: int, seed: int = 1) -> List[int]:
+    """
+    One random 64-bit mask per MinHash function: h_i(x) = hash64(x) XOR mask_i.
+    That is about three times faster in Python than the (a * x + b) mod p family
+    and accurate enough with a well-mixed 64-bit base hash.
+    """
+    # Fixed seed: every worker process computes the same signatures
+    rng = random.Random(seed)
+    return [rng.getrandbits(64) for _ in range(count)]
+
+
+def hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+
+
+def shingles(text: str, size: int = TEMPLATE_SHINGLE_SIZE) -> List[str]:
+    """Word n-grams of the lower-cased text. Numbers are masked, as templates usually vary them."""
+    words = ["#" if word.isdigit() else word for word in WORD_RE.findall(text.lower())]
+    if len(words) <= size:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+class Cluster:
+    __slots__ = ("id", "signature", "band_keys", "size", "verdicts", "flagged", "score_sum",
+                 "sample", "first_seen", "last_seen")
+
+    def __init__(self, cluster_id: int, signature: Signature, band_keys: List[Tuple[int, int]], sample: str,
+                 timestamp: str):
+        self.id = cluster_id
+        # The first member's signature represents the cluster
+        self.signature = signature
+        self.band_keys = band_keys
+        self.size = 0
+        # Fresh LLM verdicts only: verdicts given from the cluster itself, the verdict
+        # cache or a coalesced call are not independent evidence
+        self.verdicts = 0
+        self.flagged = 0
+        self.score_sum = 0.0
+        self.sample = sample
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+
+    @property
+    def agreement(self) -> float:
+        """Share of the LLM verdicts that agree with the majority."""
+        if not self.verdicts:
+            return 0.0
+        return max(self.flagged, self.verdicts - self.flagged) / self.verdicts
+
+    @property
+    def decided(self) -> bool:
+        return self.verdicts >= TEMPLATE_MIN_VERDICTS and self.agreement >= TEMPLATE_MIN_AGREEMENT
+
+    def verdict(self) -> Dict[str, Any]:
+        """The cluster's consensus, as FraudDetection fields."""
+        fraud = int(self.flagged * 2 > self.verdicts)
+        agreeing = self.flagged if fraud else self.verdicts - self.flagged
+        judged = "fraudulent" if fraud else "legitimate"
+        return {
+            "fraud": fraud,
+            "score": round(self.score_sum / self.verdicts, 2) if self.verdicts else 0.0,
+            # The members' own comments describe other texts and locations
+            "comment": f"Near-identical to {self.size} earlier messages from a repeated template; "
+                       f"{agreeing} of {self.verdicts} that were analyzed were judged {judged}.",
+        }
+
+    def describe(self) -> str:
+        """
+        Hint for the LLM input. It leaves out how the earlier messages were scored: the
+        verdicts given with this hint count towards the cluster's tally, which would
+        otherwise end up confirming itself.
+        """
+        return f"near-identical to {self.size} earlier messages (a repeated template)"
+
+
+class TemplateIndex:
+    """MinHash signatures banded into LSH buckets, with a bounded LRU of clusters."""
+
+    def __init__(self, num_hashes: int = TEMPLATE_NUM_HASHES, bands: int = TEMPLATE_BANDS,
+                 threshold: float = TEMPLATE_SIMILARITY, max_clusters: int = TEMPLATE_MAX_CLUSTERS):
+        self.masks = make_hash_masks(num_hashes)
+        self.bands = bands
+        self.rows = num_hashes // bands
+        self.threshold = threshold
+        self.max_clusters = max_clusters
+        self._clusters: "OrderedDict[int, Cluster]" = OrderedDict()
+        # (band, hash of the band's rows) -> ids of clusters with that band
+        self._buckets: Dict[Tuple[int, int], List[int]] = {}
+        self._signatures: "OrderedDict[str, Signature]" = OrderedDict()
+        self._next_id = 1
+        # Highest log id recorded, so entries seen by both rebuild and listener count once
+        self.last_id = 0
+
+        # Counters
+        self.recorded = 0
+        self.lookups = 0
+        self.matches = 0
+        self.evicted = 0
+        self.rebuild_seconds = 0.0
+
+    def signature(self, text: str) -> Optional[Signature]:
+        """MinHash signature of text, or None if it is too short to compare reliably."""
+        cached = self._signatures.get(text)
+        if cached is not None:
+            return cached
+        grams = shingles(text)
+        if len(grams) + TEMPLATE_SHINGLE_SIZE - 1 < TEMPLATE_MIN_WORDS:
+            return None
+        hashes = list({hash64(gram) for gram in grams})
+        signature = tuple(min([h ^ mask for h in hashes]) for mask in self.masks)
+        self._signatures[text] = signature
+        if len(self._signatures) > SIGNATURE_CACHE_SIZE:
+            self._signatures.popitem(last=False)
+        return signature
+
+    def _band_keys(self, signature: Signature) -> List[Tuple[int, int]]:
+        return [(band, hash(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+
+    def _find(self, signature: Signature, band_keys: List[Tuple[int, int]]) -> Tuple[Optional[Cluster], float]:
+        """Most similar cluster sharing a band with the signature, and the estimated similarity."""
+        best, best_similarity = None, 0.0
+        seen = set()
+        for key in band_keys:
+            for cluster_id in self._buckets.get(key, ()):
+                if cluster_id in seen:
+                    continue
+                seen.add(cluster_id)
+                cluster = self._clusters[cluster_id]
+                # Share of equal MinHash values estimates the Jaccard similarity of the shingle sets
+                similarity = sum(x == y for x, y in zip(signature, cluster.signature)) / len(signature)
+                if similarity > best_similarity:
+                    best, best_similarity = cluster, similarity
+        if best_similarity < self.threshold:
+            return None, best_similarity
+        return best, best_similarity
+
+    def match(self, text: str) -> Optional[Tuple[Cluster, float]]:
+        """The cluster a new request text belongs to, with its similarity, if any."""
+        self.lookups += 1
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        cluster, similarity = self._find(signature, self._band_keys(signature))
+        if cluster is None:
+            return None
+        self.matches += 1
+        return cluster, similarity
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Add a scored request log entry to its cluster, starting a new one if none is similar."""
+        response = entry.get("response")
+        if response is None:
+            return
+        entry_id = entry.get("id")
+        if entry_id is not None:
+            if entry_id <= self.last_id:
+                return
+            self.last_id = entry_id
+        text = (entry.get("request") or {}).get("request_text")
+        signature = self.signature(text) if text else None
+        if signature is None:
+            return
+
+        band_keys = self._band_keys(signature)
+        cluster, _ = self._find(signature, band_keys)
+        timestamp = entry.get("timestamp", "")
+        if cluster is None:
+            cluster = Cluster(self._next_id, signature, band_keys, text[:200], timestamp)
+            self._next_id += 1
+            self._clusters[cluster.id] = cluster
+            for key in band_keys:
+                self._buckets.setdefault(key, []).append(cluster.id)
+            if len(self._clusters) > self.max_clusters:
+                self._evict()
+        else:
+            self._clusters.move_to_end(cluster.id)
+        cluster.size += 1
+        cluster.last_seen = timestamp
+        # Entries logged before verdicts had a source came from the LLM
+        if (response.get("source", "llm") == "llm" and not response.get("reused")
+                and response.get("score") is not None):
+            cluster.verdicts += 1
+            cluster.flagged += 1 if response.get("fraud") else 0
+            cluster.score_sum += float(response["score"])
+        self.recorded += 1
+
+    def record_entries(self, entries: List[Dict[str, Any]]) -> None:
+        """Log writer listener."""
+        for entry in entries:
+            self.record(entry)
+
+    def _evict(self) -> None:
+        _, cluster = self._clusters.popitem(last=False)
+        for key in cluster.band_keys:
+            bucket = self._buckets[key]
+            bucket.remove(cluster.id)
+            if not bucket:
+                del self._buckets[key]
+        self.evicted += 1
+
+    def top_clusters(self, n: int, min_size: int = 2) -> List[Cluster]:
+        """Largest clusters, for the admin UI."""
+        clusters = [cluster for cluster in self._clusters.values() if cluster.size >= min_size]
+        return sorted(clusters, key=lambda cluster: cluster.size, reverse=True)[:n]
+
+    def rebuild(self, max_entries: int = TEMPLATE_REBUILD_MAX_ENTRIES) -> None:
+        """Reload the index from the newest max_entries scored entries of the request log."""
+        started = time.perf_counter()
+        entries = list(query_requests(newest_first=True, limit=max_entries))
+        for entry in reversed(entries):
+            self.record(entry)
+        self.rebuild_seconds = time.perf_counter() - started
+        print(f"Template index rebuilt: {len(self._clusters)} clusters from {len(entries)} entries "
+              f"in {self.rebuild_seconds:.2f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clusters": len(self._clusters),
+            "recorded": self.recorded,
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "evicted": self.evicted,
+            "rebuild_seconds": self.rebuild_seconds,
+        }
+
+
+# Shared index; server.py rebuilds it on startup and registers it as a log writer listener
+template_index = TemplateIndex()
@@ -0,0 +1,173 @@
+"""
+Per-user behavioral history kept in memory and fed into scoring.
+
+The index is updated from every request log entry as it is written (it is a log
+writer listener) and rebuilt from the request log on startup, so looking up a user
+never touches storage. Each user keeps at most HISTORY_RECENT timestamps and scores,
+and at most HISTORY_MAX_USERS users are kept (least recently seen are evicted).
+"""
+import datetime
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from rules import has_location
+from storage import query_requests, parse_timestamp
+from config import HISTORY_MAX_USERS, HISTORY_RECENT, HISTORY_REBUILD_DAYS, HISTORY_NEARBY_KM
+
+DAY = 24 * 3600.0
+
+
+def distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance (haversine)."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+
+def describe_age(seconds: float) -> str:
+    """Coarse duration; the exact figure adds nothing to the scoring input."""
+    if seconds < 60:
+        return "under a minute"
+    if seconds < 3600:
+        return "under an hour"
+    if seconds < DAY:
+        return "under a day"
+    if seconds < 7 * DAY:
+        return "under a week"
+    return "over a week"
+
+
+class UserHistory:
+    __slots__ = ("timestamps", "scores", "total", "flagged", "latitude", "longitude")
+
+    def __init__(self, recent: int):
+        self.timestamps: Deque[float] = deque(maxlen=recent)
+        self.scores: Deque[float] = deque(maxlen=recent)
+        self.total = 0
+        self.flagged = 0
+        self.latitude: Optional[float] = None
+        self.longitude: Optional[float] = None
+
+
+class UserHistoryIndex:
+    """Bounded LRU map of user_id -> UserHistory."""
+
+    def __init__(self, max_users: int = HISTORY_MAX_USERS, recent: int = HISTORY_RECENT):
+        self.max_users = max_users
+        self.recent = recent
+        self._users: "OrderedDict[str, UserHistory]" = OrderedDict()
+        # Highest log id recorded; entries are skipped if seen twice (rebuild vs. listener)
+        self.last_id = 0
+        self.recorded = 0
+        self.evicted = 0
+        self.lookups = 0
+        self.hits = 0
+        self.rebuild_seconds = 0.0
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Add one request log entry to its user's history."""
+        response = entry.get("response")
+        request = entry.get("request") or {}
+        user_id = request.get("user_id")
+        if response is None or not user_id:
+            # Pending async jobs and anonymous requests
+            return
+        entry_id = entry.get("id")
+        if entry_id is not None:
+            if entry_id <= self.last_id:
+                return
+            self.last_id = entry_id
+        timestamp = parse_timestamp(entry.get("timestamp"))
+        if timestamp is None:
+            return
+
+        history = self._users.get(user_id)
+        if history is None:
+            history = self._users[user_id] = UserHistory(self.recent)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._users.move_to_end(user_id)
+        history.timestamps.append(timestamp)
+        history.total += 1
+        if response.get("score") is not None:
+            history.scores.append(float(response["score"]))
+        if response.get("fraud"):
+            history.flagged += 1
+        latitude, longitude = request.get("latitude"), request.get("longitude")
+        if has_location(latitude, longitude):
+            history.latitude, history.longitude = latitude, longitude
+        self.recorded += 1
+
+    def record_entries(self, entries: List[Dict[str, Any]]) -> None:
+        """Log writer listener."""
+        for entry in entries:
+            self.record(entry)
+
+    def summary(self, user_id: Optional[str], latitude: Optional[float] = None,
+                longitude: Optional[float] = None, now: Optional[float] = None) -> Optional[str]:
+        """
+        A short description of the user's previous requests for the LLM input, or None
+        for anonymous or unknown users. It changes with every logged request, so it is
+        not part of the verdict cache key; the user_id is, whenever there is a summary.
+        """
+        if not user_id:
+            return None
+        self.lookups += 1
+        history = self._users.get(user_id)
+        if history is None:
+            return None
+        self.hits += 1
+        now = time.time() if now is None else now
+        timestamps = sorted(history.timestamps)
+
+        def count_since(seconds: float) -> str:
+            count = sum(1 for t in timestamps if t >= now - seconds)
+            # Only the most recent HISTORY_RECENT requests are kept
+            return f"{count}+" if count == len(timestamps) == self.recent else str(count)
+
+        parts = [
+            f"{history.total} previous requests ({count_since(DAY)} in the last 24 hours, "
+            f"{count_since(7 * DAY)} in the last 7 days)",
+            f"{history.flagged} flagged as fraud",
+        ]
+        if history.scores:
+            parts.append(f"average recent fraud score {sum(history.scores) / len(history.scores):.1f}")
+        parts.append(f"last request {describe_age(now - timestamps[-1])} ago")
+        if len(timestamps) > 1:
+            intervals = sorted(b - a for a, b in zip(timestamps, timestamps[1:]))
+            parts.append(f"typically {describe_age(intervals[len(intervals) // 2])} between requests")
+        if history.latitude is not None and has_location(latitude, longitude):
+            distance = distance_km(history.latitude, history.longitude, latitude, longitude)
+            if distance <= HISTORY_NEARBY_KM:
+                parts.append("sent from near the previous location")
+            else:
+                parts.append(f"sent about {round(distance, -2):.0f} km from the previous location")
+        return "; ".join(parts)
+
+    def rebuild(self, days: float = HISTORY_REBUILD_DAYS) -> None:
+        """Reload the index from the last days of the request log, oldest first."""
+        started = time.perf_counter()
+        since = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+        for entry in query_requests(since=since):
+            self.record(entry)
+        self.rebuild_seconds = time.perf_counter() - started
+        print(f"User history rebuilt: {len(self._users)} users in {self.rebuild_seconds:.2f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": len(self._users),
+            "recorded": self.recorded,
+            "evicted": self.evicted,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "rebuild_seconds": self.rebuild_seconds,
+        }
+
+
+# Shared index; server.py rebuilds it on startup and registers it as a log writer listener
+user_history = UserHistoryIndex()
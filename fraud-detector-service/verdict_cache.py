@@ -0,0 +1,136 @@
+"""
+Memoization of fraud verdicts for repeated submissions.
+Entries expire after a TTL and the least recently used ones are evicted past a size bound.
+"""
+import hashlib
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from config import (
+    FRAUD_PROMPT, PRIMARY_MODEL, FALLBACK_MODELS,
+    VERDICT_CACHE_MAX_ENTRIES, VERDICT_CACHE_TTL, VERDICT_CACHE_GEO_BUCKET_DEGREES,
+)
+from storage import DATA_DIR
+
+CACHE_FILE = DATA_DIR / "verdict_cache.json"
+
+# Changing the prompt or the models invalidates every cached verdict
+PROMPT_VERSION = hashlib.sha256(
+    "\n".join([FRAUD_PROMPT, PRIMARY_MODEL, *FALLBACK_MODELS]).encode()
+).hexdigest()[:16]
+
+
+def normalize_email(text: str) -> str:
+    """Collapse whitespace and case so trivially different copies share a key."""
+    return " ".join(text.split()).lower()
+
+
+def geo_bucket(latitude: Optional[float], longitude: Optional[float]) -> str:
+    """Quantize a location to a grid cell of VERDICT_CACHE_GEO_BUCKET_DEGREES."""
+    if latitude is None or longitude is None:
+        return "none"
+    size = VERDICT_CACHE_GEO_BUCKET_DEGREES
+    return f"{math.floor(latitude / size)}:{math.floor(longitude / size)}"
+
+
+def make_cache_key(customer_email: str, latitude: Optional[float] = None, longitude: Optional[float] = None,
+                   user_id: Optional[str] = None) -> str:
+    """user_id scopes the key to one user, for verdicts that depend on that user's history."""
+    parts = [PROMPT_VERSION, geo_bucket(latitude, longitude), normalize_email(customer_email)]
+    if user_id:
+        parts.append(f"user:{user_id}")
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+class VerdictCache:
+    """LRU cache of verdict dicts with a per-entry TTL."""
+
+    def __init__(self, max_entries: int = VERDICT_CACHE_MAX_ENTRIES, ttl: float = VERDICT_CACHE_TTL,
+                 path: Path = CACHE_FILE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        # key -> (expires_at, verdict); wall-clock expiry so it survives a restart
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, verdict = item
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return verdict
+
+    def put(self, key: str, verdict: Dict[str, Any]) -> None:
+        self._entries[key] = (time.time() + self.ttl, verdict)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def save(self) -> None:
+        """Write unexpired entries to disk, oldest first so LRU order is preserved on load."""
+        now = time.time()
+        data = {
+            "prompt_version": PROMPT_VERSION,
+            "entries": [[key, expires_at, verdict]
+                        for key, (expires_at, verdict) in self._entries.items() if expires_at > now],
+        }
+        # Per-process temp file, as several workers may save at shutdown
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> None:
+        """Warm the cache from disk, ignoring entries written for another prompt version."""
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if data.get("prompt_version") != PROMPT_VERSION:
+            return
+        now = time.time()
+        for key, expires_at, verdict in data.get("entries", []):
+            if expires_at > now:
+                self._entries[key] = (expires_at, verdict)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+# Shared cache used by fraud_detector
+verdict_cache = VerdictCache()
@@ -5,7 +5,7 @@ Simple command-line utility to view stored fraud detection requests.
 import argparse
 import json
 from typing import Dict, Any, List
-from storage import get_requests_sync
+from storage import query_requests, last_requests, count_requests, maintain_log
 
 def print_request(request: Dict[str, Any], detailed: bool = False) -> None:
     """Print a single request in a readable format."""
@@ -33,21 +33,45 @@ def main():
     parser.add_argument("--all", action="store_true", help="Show all requests")
     parser.add_argument("--last", type=int, default=5, help="Show last N requests")
     parser.add_argument("--detailed", action="store_true", help="Show detailed request/response data")
+    parser.add_argument("--since", help="Only requests at or after this ISO timestamp (e.g. 2024-05-01)")
+    parser.add_argument("--until", help="Only requests before this ISO timestamp")
+    parser.add_argument("--user", help="Only requests from this user ID")
+    parser.add_argument("--min-score", type=float, help="Only requests with score >= this value")
+    parser.add_argument("--max-score", type=float, help="Only requests with score < this value")
+    parser.add_argument("--fraud", type=int, choices=[0, 1], help="Only requests with this fraud flag")
+    parser.add_argument("--maintain", action="store_true",
+                        help="Archive closed log segments and apply retention, then exit")
     args = parser.parse_args()
+
+    if args.maintain:
+        done = maintain_log()
+        print(", ".join(f"{key}: {value}" for key, value in done.items()) or "Nothing to do")
+        return
+
+    filters = {
+        "since": args.since,
+        "until": args.until,
+        "user_id": args.user,
+        "min_score": args.min_score,
+        "max_score": args.max_score,
+        "fraud": args.fraud,
+    }
+    filters = {key: value for key, value in filters.items() if value is not None}
     
-    requests = get_requests_sync()
+    total = count_requests()
     
-    if not requests:
+    if not total:
         print("No requests stored yet.")
         return
     
-    print(f"Total requests: {len(requests)}")
+    print(f"Total requests: {total}")
     
     if args.all:
-        for req in requests:
+        # Stream entries so the full history is never held in memory
+        for req in query_requests(**filters):
             print_request(req, args.detailed)
     else:
-        for req in requests[-args.last:]:
+        for req in last_requests(args.last, **filters):
             print_request(req, args.detailed)
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+"""
+Pre-fork multi-process mode. The parent opens the listening socket (or, with
+SERVER_REUSE_PORT, lets each worker bind the port with SO_REUSEPORT), forks one
+aiohttp server per worker, restarts workers that die, and on SIGTERM/SIGINT asks
+them to finish in-flight requests and flush the request log before exiting.
+"""
+import asyncio
+import os
+import signal
+import socket
+import time
+import traceback
+from typing import Dict, Optional
+
+import server
+from admission import admission
+from jobs import job_manager
+from log_writer import log_writer
+from metrics import registry
+from storage import DATA_DIR
+from config import (
+    SERVER_HOST, SERVER_PORT, SERVER_REUSE_PORT, WORKER_SHUTDOWN_TIMEOUT, METRICS_SNAPSHOT_INTERVAL,
+)
+
+METRICS_DIR = DATA_DIR / "metrics"
+# A worker that dies sooner than this after starting is restarted only after a pause
+MIN_WORKER_UPTIME = 5.0
+
+
+def configure_worker(index: int, count: int) -> None:
+    """Adjust the per-process singletons for running alongside count - 1 other workers."""
+    registry.enable_aggregation(METRICS_DIR, index)
+    admission.share(count)
+    # Log listeners (admin live updates, user history) see entries written by any worker
+    log_writer.follow_log()
+    # One process archiving segments is enough
+    if index != 0:
+        log_writer.maintenance_interval = None
+    # Each worker re-queues the unfinished jobs it accepted, also after it was restarted
+    job_manager.process_index = index
+    job_manager.process_count = count
+
+
+async def write_metric_snapshots() -> None:
+    while True:
+        await asyncio.sleep(METRICS_SNAPSHOT_INTERVAL)
+        snapshot = registry.snapshot()
+        await asyncio.to_thread(registry.write_snapshot, snapshot)
+
+
+async def serve_worker(host: str, port: int, sock: Optional[socket.socket], reuse_port: bool) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    snapshots = asyncio.create_task(write_metric_snapshots())
+    try:
+        await server.main(host, port, sock=sock, reuse_port=reuse_port, stop=stop)
+    finally:
+        snapshots.cancel()
+        # Final counts, so /metrics on the other workers includes everything this one did
+        registry.write_snapshot()
+
+
+def spawn_worker(index: int, count: int, host: str, port: int,
+                 sock: Optional[socket.socket], reuse_port: bool) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    # Child: the parent's signal handlers must not run here
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        configure_worker(index, count)
+        asyncio.run(serve_worker(host, port, sock, reuse_port))
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def run_workers(count: int, host: str = SERVER_HOST, port: int = SERVER_PORT,
+                reuse_port: bool = SERVER_REUSE_PORT) -> None:
+    """Run count worker processes until SIGTERM or SIGINT, then stop them gracefully."""
+    sock = None
+    if not reuse_port:
+        # Opened before forking, so every worker accepts from the same socket
+        sock = socket.create_server((host, port), backlog=1024)
+    # Snapshots left by a previous run would be counted as live workers
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    for path in METRICS_DIR.glob("worker-*.json"):
+        path.unlink()
+
+    children: Dict[int, int] = {}
+    started: Dict[int, float] = {}
+    stopping = False
+    deadline = 0.0
+
+    def stop_workers(signum, frame) -> None:
+        nonlocal stopping, deadline
+        if stopping:
+            return
+        stopping = True
+        deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+        print(f"Stopping {len(children)} workers...")
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+
+    print(f"Starting {count} workers on http://{host}:{port}...")
+    for index in range(count):
+        pid = spawn_worker(index, count, host, port, sock, reuse_port)
+        children[pid] = index
+        started[index] = time.monotonic()
+
+    while children:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            if stopping and time.monotonic() > deadline:
+                print(f"Killing {len(children)} workers that did not stop in {WORKER_SHUTDOWN_TIMEOUT}s")
+                for child in children:
+                    os.kill(child, signal.SIGKILL)
+                deadline = float("inf")
+            time.sleep(0.2)
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting")
+        if time.monotonic() - started[index] < MIN_WORKER_UPTIME:
+            # Avoid a tight crash loop
+            time.sleep(MIN_WORKER_UPTIME)
+        if stopping:
+            continue
+        children[spawn_worker(index, count, host, port, sock, reuse_port)] = index
+        started[index] = time.monotonic()
+
+    if sock is not None:
+        sock.close()
+    print("\nServer stopped gracefully.")